@@ -1,55 +1,251 @@
-from dotenv import load_dotenv
-from smartsheet import Smartsheet
-from lib import Database, Todo, Util, Controller
-from os import environ
+from dotenv import load_dotenv, find_dotenv
+from lib import Database, Todo, Util, Controller, Mirror, RequestScheduler, ScheduledSmartsheet, LazySmartsheet, Stats, Executor, Snapshot, Daemon, DaemonClient, Shards
+from os import environ, path
 from datetime import datetime
 from typing import List
 from operator import methodcaller
-# https://stackoverflow.com/questions/8469122/maximum-characters-that-can-be-stuffed-into-raw-input-in-python
-import readline  # raises the input buffer
+from argparse import ArgumentParser
+from contextlib import ExitStack, redirect_stdout
+import io
+import json
+import sys
 load_dotenv()
 
-def main(table_name:str|None=None, folder_id:str|None=None) -> None:
+# commands left out of the history
+HISTORY_COMMANDS = ["history", "clear", "reset", "clear_history", "reset_history", "exit", "quit"]
+# writes of consecutive script commands of these kinds are sent together
+COALESCED_COMMANDS = ["set", "finish", "unfinish"]
+# commands timed under their own name by Stats, anything else typed is timed as other
+STATS_COMMANDS = ["list", "ls", "la", "week", "overdue", "due", "see", "search", "rm", "finish", "unfinish", "delete", "remove", "set", "create", "archive", "sync", "import", "export", "help", "stats"] + HISTORY_COMMANDS
+# seconds between background checks of the sheet when writing behind without SHEET_REFRESH_INTERVAL
+WRITE_BEHIND_REFRESH_INTERVAL = 60
+
+def main(table_name:str|None=None, folder_id:str|None=None, cache_ttl:float=0, cache_dir:str|None=None, incremental:bool=False, mirror_file:str|None=None, requests_per_minute:float=300, stats_file:str|None=None, archive_after_days:int|None=None, shard_keys:List[str]|None=None, workers:int=4, script:List[str]|None=None, json_output:bool=False, refresh_interval:float|None=None, write_behind:bool=False, socket_path:str|None=None, serve:bool=False, webhook_url:str|None=None, webhook_port:int=8080) -> int:
+    """ Runs the prompt, or the script commands when given, returns the exit status.
+    With a daemon serving socket_path the commands run there, serve makes this process that daemon """
     try:
         if table_name is None:
             print("Please configure a table name")
-            return
+            return 1
+        client = None if serve or socket_path is None else DaemonClient.connect(socket_path)
+        if client is not None:
+            return run_client(client, script, json_output)
+
+        mirror = None if mirror_file is None else Mirror(path.join(cache_dir or ".", mirror_file))
+        # retries are left to the scheduler, which also paces requests to the rate limit,
+        # the SDK is only imported once the first request is made
+        smart = ScheduledSmartsheet(LazySmartsheet(max_retry_time=0), RequestScheduler(requests_per_minute))
+        snapshot = Snapshot(path.join(cache_dir or ".", ".snapshot.json"))
+        if script is not None:
+            # the whole script runs against the sheet as loaded once, patched by its own writes
+            cache_ttl = float("inf")
+        db = Database(smart, cache_ttl, cache_dir, incremental, Executor(workers))
+        if write_behind:
+            # writes left by an earlier run are sent first
+            try:
+                db.start_journal(path.join(cache_dir or ".", ".journal.jsonl"))
+            except OSError as e:
+                print(f"{e}, writes are sent right away instead", file=sys.stderr)
+                write_behind = False
+        if webhook_url is not None and script is None:
+            # registering waits on the SDK and a few requests, the sheets are checked as usual until it is done
+            db.executor.submit(db.start_webhooks, webhook_url, webhook_port, Shards(db, table_name, shard_keys).names())
+        with redirect_stdout(sys.stderr) if json_output else ExitStack():
+            # the prompt shows while the sheets load, a script needs them right away
+            controller = Controller(db, table_name, folder_id, mirror, archive_after_days, shard_keys, snapshot, defer=script is None)
+        if script is not None:
+            code = run_script(controller, script, json_output, stats_file)
+            return flush_journal(db) or code
 
-        controller = Controller(Database(Smartsheet()), table_name, folder_id)
+        if refresh_interval is None and write_behind:
+            # a write must not wait on a check of the sheet version, the refresher checks it in the background instead
+            refresh_interval = WRITE_BEHIND_REFRESH_INTERVAL
+        if refresh_interval is not None:
+            controller.db.start_refresher(refresh_interval)
+        if serve and socket_path is not None:
+            print(f"Serving {table_name} on {socket_path}")
+            Daemon(socket_path, lambda request, session: serve_request(controller, request, session, stats_file)).serve_forever()
+            return 0
+        # https://stackoverflow.com/questions/8469122/maximum-characters-that-can-be-stuffed-into-raw-input-in-python
+        import readline  # raises the input buffer
         history:List[str] = []
-        save_command = True
-        command = ""
-        while command != "quit":
-            commands = str(input("> ")).strip().split(" ")
-            command = commands[0]
-            match command:
-                case "list" | "ls" | "la" | "week":
-                    controller.list(commands)
-                case "see":
-                    controller.see(commands[1])
-                case "rm" | "finish" | "unfinish" | "delete" | "remove":
-                    controller.run_generic_command(command, commands[1])
-                case "set":
-                    controller.set_attribute(commands)
-                case "create":
-                    controller.create(commands)
-                case "history":
-                    save_command = False
-                    {print(x) for x in history}
-                case "clear" | "reset" | "clear_history" | "reset_history":
-                    save_command = False
-                    history.clear()
-                case "exit" | "quit":
-                    save_command = False
-                    command = "quit"
-                case _:
-                    controller.help()
-            if save_command:
-                history.append(" ".join(commands))
-            else:
-                save_command = True
+        while True:
+            # the sheet downloads while the user is typing
+            controller.prefetch()
+            line = str(input(controller.prompt())).strip()
+            if line.split(" ")[0] in ["exit", "quit"]:
+                return 0
+            run_line(controller, line, history, stats_file)
     except KeyboardInterrupt:
-        return
+        return 130
+
+def run_line(controller:Controller, line:str, history:List[str], stats_file:str|None=None) -> int:
+    """ Runs a command typed at the prompt, returns 1 when it failed """
+    commands = line.split(" ")
+    command = commands[0]
+    with Stats.command(stats_label(command)):
+        ok = run_command(controller, commands, history)
+    if stats_file is not None:
+        Stats.export(stats_file)
+    if command not in HISTORY_COMMANDS:
+        history.append(" ".join(commands))
+    return 0 if ok else 1
+
+def stats_label(command:str) -> str:
+    """ Keeps the labels of the exported stats to the known commands """
+    return command if command in STATS_COMMANDS else "other"
+
+def run_command(controller:Controller, commands:List[str], history:List[str]) -> bool:
+    """ Runs one command, returns whether it worked """
+    command = commands[0]
+    match command:
+        case "list" | "ls" | "la" | "week" | "overdue" | "due":
+            return controller.list(commands)
+        case "see":
+            ids = [x for x in commands[1:] if x != "--fresh"]
+            return controller.see(ids[0] if len(ids) else "", "--fresh" in commands)
+        case "search":
+            return controller.search(commands)
+        case "rm" | "finish" | "unfinish" | "delete" | "remove":
+            return controller.run_generic_command(command, commands[1:])
+        case "set":
+            return controller.set_attribute(commands)
+        case "create":
+            return controller.create(commands)
+        case "archive":
+            return controller.archive(commands)
+        case "sync":
+            return controller.sync()
+        case "import":
+            return controller.import_file(commands)
+        case "export":
+            return controller.export(commands)
+        case "history":
+            {print(x) for x in history}
+        case "clear" | "reset" | "clear_history" | "reset_history":
+            history.clear()
+        case "stats":
+            controller.stats()
+        case _:
+            controller.help()
+            return command == "help"
+    return True
+
+def run_script(controller:Controller, script:List[str], json_output:bool=False, stats_file:str|None=None) -> int:
+    """ Runs the commands in one session, returns 1 when any of them failed """
+    failed = False
+    history:List[str] = []
+    batch = ExitStack()
+    batching = False
+
+    def report(line:str, ok:bool, output:List[dict], messages:str) -> None:
+        if json_output:
+            print(json.dumps({"command": line, "ok": ok, "todos": output, "messages": messages.splitlines()}))
+        elif messages:
+            print(messages, end="")
+
+    def flush() -> bool:
+        """ Send the writes coalesced so far """
+        nonlocal batching
+        batching = False
+        messages = io.StringIO()
+        with redirect_stdout(messages):
+            batch.close()
+            errors = controller.take_errors()
+        if len(errors):
+            report("commit", False, [], messages.getvalue() + "\n".join(errors) + "\n")
+        return len(errors) == 0
+
+    for line in script:
+        commands = line.split(" ")
+        command = commands[0]
+        if command in ["exit", "quit"]:
+            break
+        if command not in COALESCED_COMMANDS:
+            failed = not flush() or failed
+        elif not batching:
+            batch.enter_context(controller.batch())
+            batching = True
+        controller.output = [] if json_output else None
+        messages = io.StringIO()
+        with Stats.command(stats_label(command)), redirect_stdout(messages):
+            ok = run_command(controller, commands, history)
+            if command not in COALESCED_COMMANDS:
+                errors = controller.take_errors()
+                ok = ok and len(errors) == 0
+                {print(x) for x in errors}
+        report(line, ok, controller.output or [], messages.getvalue())
+        failed = failed or not ok
+        if stats_file is not None:
+            Stats.export(stats_file)
+        history.append(line)
+    failed = not flush() or failed
+    controller.output = None
+    return 1 if failed else 0
+
+def serve_request(controller:Controller, request:dict, session:dict, stats_file:str|None=None) -> dict:
+    """ Runs a line typed at the prompt of a client, or its script, with the output sent back to it """
+    output = io.StringIO()
+    status = 0
+    with redirect_stdout(output):
+        try:
+            if "script" in request:
+                status = run_script(controller, request["script"], request.get("json", False), stats_file)
+            elif "line" in request:
+                status = run_line(controller, request["line"].strip(), session.setdefault("history", []), stats_file)
+        except Exception as e:
+            # the daemon keeps serving the other clients
+            print(f"Unable to run the command: {e}")
+            status = 1
+    # the sheet downloads while the client is typing
+    controller.prefetch()
+    return {"output": output.getvalue(), "status": status, "prompt": controller.prompt()}
+
+def run_client(client:DaemonClient, script:List[str]|None, json_output:bool=False) -> int:
+    """ Thin client of a daemon, sends it the script or every line typed """
+    with client:
+        if script is not None:
+            response = client.request({"script": script, "json": json_output})
+            print(response["output"], end="")
+            return response["status"]
+        import readline  # raises the input buffer
+        prompt = client.request({})["prompt"]
+        while True:
+            line = str(input(prompt)).strip()
+            if line.split(" ")[0] in ["exit", "quit"]:
+                return 0
+            response = client.request({"line": line})
+            print(response["output"], end="")
+            prompt = response["prompt"]
+
+def flush_journal(db:Database) -> int:
+    """ Send the writes a script left behind before exiting, returns 1 when some could not be sent """
+    if db.journal is None:
+        return 0
+    db.journal.flush()
+    pending, failed = db.journal.counts()
+    if pending:
+        print(f"{pending} writes not sent yet, {failed} of them failed, they are sent on the next run", file=sys.stderr)
+    return 1 if pending else 0
+
+def read_script(args:List[str]) -> tuple[List[str]|None, bool, bool]:
+    """ Script commands from -c, a file or - for stdin, None for the prompt, whether to print json and whether to serve as the daemon """
+    parser = ArgumentParser(description="Todo app using a Smartsheet as its store, prompts for commands unless given some")
+    parser.add_argument("file", nargs="?", help="file with one command per line, - reads stdin")
+    parser.add_argument("-c", "--command", help='commands separated by ;, e.g. "finish 3; ls"')
+    parser.add_argument("--json", action="store_true", help="print one json object per command")
+    parser.add_argument("--serve", action="store_true", help="serve the other app.py processes of this host from one session, see SHEET_DAEMON_SOCKET")
+    parsed = parser.parse_args(args)
+    if parsed.command is not None:
+        return Util.split_commands(parsed.command), parsed.json, parsed.serve
+    if parsed.file == "-":
+        return Util.split_commands(sys.stdin.read()), parsed.json, parsed.serve
+    if parsed.file is not None:
+        with open(parsed.file) as f:
+            return Util.split_commands(f.read()), parsed.json, parsed.serve
+    return None, parsed.json, parsed.serve
 
 if __name__ == "__main__":
-    main(environ.get("SHEET_NAME", None), environ.get("FOLDER_ID", None))
+    script, json_output, serve = read_script(sys.argv[1:])
+    cache_dir = path.dirname(path.abspath(find_dotenv() or ".env"))
+    sys.exit(main(environ.get("SHEET_NAME", None), environ.get("FOLDER_ID", None), float(environ.get("SHEET_CACHE_TTL", 0)), cache_dir, environ.get("SHEET_INCREMENTAL_SYNC", "") == "1", environ.get("SQLITE_MIRROR", None), float(environ.get("SMARTSHEET_REQUESTS_PER_MINUTE", 300)), environ.get("STATS_EXPORT", None), int(environ["ARCHIVE_AFTER_DAYS"]) if environ.get("ARCHIVE_AFTER_DAYS") else None, [x.strip() for x in environ.get("SHEET_SHARDS", "").split(",") if x.strip()], int(environ.get("SMARTSHEET_WORKERS", 4)), script, json_output, float(environ["SHEET_REFRESH_INTERVAL"]) if environ.get("SHEET_REFRESH_INTERVAL") else None, environ.get("SHEET_WRITE_BEHIND", "") == "1", environ.get("SHEET_DAEMON_SOCKET", path.join(cache_dir, ".daemon.sock")), serve, environ.get("SHEET_WEBHOOK_URL", None), int(environ.get("SHEET_WEBHOOK_PORT", 8080))))
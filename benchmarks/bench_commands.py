@@ -0,0 +1,114 @@
+""" Offline benchmark of Controller commands against FakeSmartsheet
+
+    python benchmarks/bench_commands.py --sizes 100 1000 10000 50000 --latency 0.05 --memory
+"""
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from os import path
+from time import perf_counter
+from typing import Any, Callable, List
+import io
+import json
+import sys
+import tempfile
+import tracemalloc
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from lib import Controller, Database, Todo, Util, RequestScheduler, ScheduledSmartsheet, Executor
+from lib.fake import FakeSmartsheet
+from lib.todo import TodoStatusType
+
+SHEET_NAME = "Todo"
+STATUSES = [x.value for x in TodoStatusType]
+
+def seed_rows(count:int, notes_size:int) -> List[dict[str, Any]]:
+    """ Mix of open and done todos with due dates spread around today """
+    today = date.today()
+    rows = []
+    for i in range(count):
+        status = STATUSES[i % len(STATUSES)]
+        row = {
+            "TaskName": f"Task number {i}",
+            "DueDate": Util.date_as_str(today + timedelta(days=(i % 60) - 30)),
+            "Status": status,
+            "Notes": "n" * notes_size,
+        }
+        if status == TodoStatusType.DONE.value:
+            row["CompletedAt"] = Util.date_as_str(today - timedelta(days=i % 365))
+        rows.append(row)
+    return rows
+
+def measure(fake:FakeSmartsheet, name:str, size:int, func:Callable, memory:bool) -> dict[str, Any]:
+    fake.reset_counters()
+    if memory:
+        tracemalloc.start()
+    start = perf_counter()
+    with redirect_stdout(io.StringIO()):
+        func()
+    seconds = perf_counter() - start
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        "command": name,
+        "rows": size,
+        "seconds": round(seconds, 4),
+        "calls": sum(fake.calls.values()),
+        "bytes": fake.bytes,
+        "peak_kb": peak // 1024,
+    }
+
+def run(size:int, args:Any) -> List[dict[str, Any]]:
+    fake = FakeSmartsheet(args.latency, args.rate_limit)
+    fake.seed_sheet(Todo.table_spec(fake, SHEET_NAME), seed_rows(size, args.notes_size))
+    smart = ScheduledSmartsheet(fake, RequestScheduler(args.requests_per_minute, base_delay=0.01))
+    db = Database(smart, executor=Executor(args.workers))
+    import_file = path.join(tempfile.mkdtemp(), "bulk.jsonl")
+    with open(import_file, "w") as f:
+        for i in range(args.bulk):
+            f.write(json.dumps({"task": f"Imported {i}", "due_date": Util.date_as_str(date.today())}) + "\n")
+
+    controller = None
+    def start() -> None:
+        nonlocal controller
+        controller = Controller(db, SHEET_NAME)
+
+    middle = str(size // 2)
+    steps = [
+        ("startup", start),
+        ("ls", lambda: controller.list(["ls"])),
+        ("week", lambda: controller.list(["week"])),
+        ("la", lambda: controller.list(["la"])),
+        ("see", lambda: controller.see(middle)),
+        ("set", lambda: controller.set_attribute(["set", middle, "task:Renamed", "due_date:2030-01-01"])),
+        ("finish", lambda: controller.run_generic_command("finish", [middle])),
+        ("ls after write", lambda: controller.list(["ls"])),
+        (f"bulk create {args.bulk}", lambda: controller.import_file(["import", import_file])),
+    ]
+    return [measure(fake, name, size, func, args.memory) for name, func in steps]
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every API call")
+    parser.add_argument("--rate-limit", type=float, default=0, help="share of API calls answered with 429")
+    parser.add_argument("--requests-per-minute", type=float, default=1e9)
+    parser.add_argument("--notes-size", type=int, default=200, help="characters of notes per row")
+    parser.add_argument("--bulk", type=int, default=1000, help="todos imported by the bulk create step")
+    parser.add_argument("--workers", type=int, default=4, help="requests sent concurrently")
+    parser.add_argument("--memory", action="store_true", help="track peak memory, slows every step down")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        results.extend(run(size, args))
+    columns = ["command", "rows", "seconds", "calls", "bytes", "peak_kb"]
+    Util.print_table([columns] + [[str(x[k]) for k in columns] for x in results])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
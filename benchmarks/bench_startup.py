@@ -0,0 +1,73 @@
+""" Startup time: module imports, time until the prompt and the first ls, against FakeSmartsheet
+
+    python benchmarks/bench_startup.py --sizes 1000 10000 --latency 0.05
+"""
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from os import path
+from time import perf_counter
+from typing import Any, List
+import io
+import json
+import subprocess
+import sys
+import tempfile
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from lib import Controller, Database, Todo, RequestScheduler, ScheduledSmartsheet, Snapshot
+from lib.fake import FakeSmartsheet
+from bench_commands import SHEET_NAME, seed_rows
+
+def import_time(module:str, runs:int) -> float:
+    """ Best wall time of a fresh interpreter importing module """
+    best = float("inf")
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], cwd=ROOT, check=True)
+        best = min(best, perf_counter() - start)
+    return best
+
+def startup(size:int, args:Any, defer:bool, snapshot_file:str|None) -> dict[str, Any]:
+    fake = FakeSmartsheet(args.latency)
+    fake.seed_sheet(Todo.table_spec(fake, SHEET_NAME), seed_rows(size, args.notes_size))
+    db = Database(ScheduledSmartsheet(fake, RequestScheduler(1e9)))
+    snapshot = None if snapshot_file is None else Snapshot(snapshot_file)
+    with redirect_stdout(io.StringIO()):
+        start = perf_counter()
+        controller = Controller(db, SHEET_NAME, snapshot=snapshot, defer=defer)
+        prompt = perf_counter() - start
+        controller.list(["ls"])
+        first_ls = perf_counter() - start
+        controller.wait_started()
+        loaded = perf_counter() - start
+    db.executor.shutdown()
+    return {"rows": size, "prompt": round(prompt, 4), "first_ls": round(first_ls, 4), "loaded": round(loaded, 4)}
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every API call")
+    parser.add_argument("--notes-size", type=int, default=200, help="characters of notes per row")
+    parser.add_argument("--runs", type=int, default=5, help="interpreters started per import measurement")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    imports = [{"module": x, "seconds": round(import_time(x, args.runs), 4)} for x in ["smartsheet", "lib", "app"]]
+    print("\n".join(f"import {x['module']}: {x['seconds']}s" for x in imports))
+    results:List[dict[str, Any]] = []
+    snapshot_file = path.join(tempfile.mkdtemp(), "snapshot.json")
+    for size in args.sizes:
+        # the eager run leaves the snapshot the last one renders
+        results.append(dict(mode="eager", **startup(size, args, False, snapshot_file)))
+        results.append(dict(mode="deferred", **startup(size, args, True, None)))
+        results.append(dict(mode="deferred+snapshot", **startup(size, args, True, snapshot_file)))
+    columns = ["mode", "rows", "prompt", "first_ls", "loaded"]
+    print()
+    for row in [columns] + [[str(x[k]) for k in columns] for x in results]:
+        print("".join(f"{x:>20}" for x in row))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"imports": imports, "startup": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+""" API calls of repeated ls while a teammate edits the sheet now and then, checking the sheet version
+on every read against being told of the changes by a webhook, against FakeSmartsheet and its webhook simulator
+
+    python benchmarks/bench_webhooks.py --sizes 1000 10000 --reads 200 --edit-every 20
+"""
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from os import path
+from time import perf_counter
+from typing import Any, List
+import io
+import json
+import socket
+import sys
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from lib import Controller, Database, Todo, Util, RequestScheduler, ScheduledSmartsheet
+from lib.fake import FakeSmartsheet
+from bench_commands import SHEET_NAME, seed_rows
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def run(size:int, args:Any, webhooks:bool) -> dict[str, Any]:
+    fake = FakeSmartsheet(args.latency)
+    sheet_id = fake.seed_sheet(Todo.table_spec(fake, SHEET_NAME), seed_rows(size, args.notes_size))
+    db = Database(ScheduledSmartsheet(fake, RequestScheduler(1e9)), incremental=args.incremental)
+    if webhooks:
+        port = free_port()
+        db.start_webhooks(f"http://127.0.0.1:{port}/", port, [SHEET_NAME])
+    with redirect_stdout(io.StringIO()):
+        controller = Controller(db, SHEET_NAME)
+        fake.reset_counters()
+        start = perf_counter()
+        for i in range(args.reads):
+            if i % args.edit_every == 0:
+                row = fake.sheets[sheet_id]["rows"][i % size]
+                fake.edit_rows(sheet_id, {row["id"]: {"TaskName": f"Edited {i}"}})
+            controller.list(["ls", "--limit", "10"])
+        seconds = perf_counter() - start
+    if db.webhooks is not None:
+        db.webhooks.stop()
+    db.executor.shutdown()
+    return {
+        "mode": "webhooks" if webhooks else "version check",
+        "rows": size,
+        "seconds": round(seconds, 4),
+        "calls": sum(fake.calls.values()),
+        "bytes": fake.bytes,
+    }
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--reads", type=int, default=200, help="ls commands run")
+    parser.add_argument("--edit-every", type=int, default=20, help="reads between two edits of a teammate")
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every API call")
+    parser.add_argument("--notes-size", type=int, default=200, help="characters of notes per row")
+    parser.add_argument("--incremental", action="store_true", help="sync changed rows instead of downloading the sheet again")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results:List[dict[str, Any]] = []
+    for size in args.sizes:
+        results.append(run(size, args, False))
+        results.append(run(size, args, True))
+    columns = ["mode", "rows", "seconds", "calls", "bytes"]
+    Util.print_table([columns] + [[str(x[k]) for k in columns] for x in results])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,22 @@
+from .stats import Stats
 from .util import Util
-from .table import Table
+from .scheduler import RequestScheduler, ScheduledSmartsheet, LazySmartsheet
+from .executor import Executor
+from .search import SearchIndex
+from .columnar import ColumnarView
+from .table import Table, SortedIndex
+from .journal import Journal
+from .resolver import SheetResolver
+from .webhook import WebhookReceiver
 from .database import Database
 from .todo import Todo
 from .todo import TodoFilterType
+from .todo import TodoSelectorFilter
+from .importer import Importer, ImportReport
+from .exporter import Exporter
+from .mirror import Mirror
+from .archive import Archive
+from .shards import Shards
+from .snapshot import Snapshot
+from .daemon import Daemon, DaemonClient
 from .controller import Controller
@@ -0,0 +1,54 @@
+from typing import List
+from datetime import date, timedelta
+from . import Database, Table, Todo, TodoFilterType
+
+# appended to the todo sheet name to name its archive sheet
+ARCHIVE_SUFFIX = "_Archive"
+
+class Archive:
+  """ Companion sheet in the same folder holding todos completed long ago, only read on demand """
+
+  def __init__(self, db:Database, table_name:str, folder_id:str|None=None) -> None:
+    self.db = db
+    self.table_name = f"{table_name}{ARCHIVE_SUFFIX}"
+    self.folder_id = folder_id
+    # set once the archive sheet is known not to exist, saves looking it up by name again
+    self.missing = False
+
+  def table(self, create:bool=False) -> Table|None:
+    """ The archive with all its columns, created in the folder when asked to """
+    table = None if self.missing and not create else self.db.find_table(self.table_name)
+    if table is None and create and self.folder_id and self.db.create_missing(self.table_name):
+      new_sheet = Todo.create_table(self.db.smart, self.table_name, self.folder_id, archive=True)
+      if isinstance(new_sheet, self.db.smart.models.Error):
+        self.db.error = new_sheet
+        return None
+      self.db.resolver.remember(self.table_name, new_sheet.id)
+      self.missing = False
+      table = self.db.find_table(self.table_name)
+    self.missing = table is None
+    return table
+
+  def archive(self, table:Table, days:int) -> tuple[List[int], List[str]]:
+    """ Move the todos completed more than days ago, returns the moved row ids and the errors """
+    cutoff = date.today() - timedelta(days=days)
+    old = [x.row.id for x in Todo._rows(table) if x.completed_at is not None and x.completed_at < cutoff]
+    if len(old) == 0:
+      return [], []
+    archive = self.table(create=True)
+    if archive is None:
+      reason = "" if self.db.error is None else f": {self.db.error.result.message}"
+      return [], [f"Unable to find or create {self.table_name}{reason}"]
+    errors = table.move_rows(old, archive)
+    left = set(map(lambda x: x.id, table.rows))
+    return [x for x in old if x not in left], errors
+
+  def find_by_id(self, id:str) -> Todo|None:
+    return Todo.find_by_id(self.table(), id)
+
+  def print_rows(self, status:str|None=None, after:date|None=None, before:date|None=None, count:int|None=None) -> List[List[str]]:
+    """ Archived todos as rows of Todo.create_print_table, without its header """
+    table = self.table()
+    if table is None:
+      return []
+    return Todo.create_print_table(table, TodoFilterType.ALL, status, after, before, count)[1:]
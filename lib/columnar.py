@@ -0,0 +1,99 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Iterable, List
+from array import array
+from datetime import date
+from functools import reduce
+from itertools import compress, repeat
+from operator import and_, eq, lt
+if TYPE_CHECKING:
+  from smartsheet.models.row import Row
+
+# ordinal of a missing date, sorts after every real one
+NO_DATE = date.max.toordinal() + 1
+
+class ColumnarView:
+  """ Columns of a table held as arrays: dates as ordinals, picklists as small codes and texts as lists,
+  filters and sorts run over whole columns at once and strings are only made for the rows shown """
+
+  def __init__(self, rows:List[Row], title_to_id:dict[str, int], dates:List[str], codes:dict[str, Any], texts:dict[str, Any]) -> None:
+    """ codes and texts map a column title to the value of a row without a cell in it """
+    self.rows = rows
+    self.row_ids = array("q")
+    self.dates = {x:array("l") for x in dates}
+    self.codes = {x:array("H") for x in codes}
+    # code -> value, per picklist column
+    self.values:dict[str, List[Any]] = {x:[] for x in codes}
+    self.texts:dict[str, List[Any]] = {x:[] for x in texts}
+    # row id -> position, built on first use
+    self.positions:dict[int, int]|None = None
+    column_ids = {x:title_to_id.get(x) for x in [*dates, *codes, *texts]}
+    known = {x:{} for x in codes}
+    for row in rows:
+      self.row_ids.append(row.id)
+      cells = {x.column_id:x for x in row.cells}
+      for field, column in self.dates.items():
+        cell = cells.get(column_ids[field])
+        value = None if cell is None else cell.value
+        column.append(NO_DATE if value is None or value == "" else date.fromisoformat(str(value)[:10]).toordinal())
+      for field, column in self.codes.items():
+        cell = cells.get(column_ids[field])
+        value = codes[field] if cell is None else cell.display_value
+        code = known[field].get(value)
+        if code is None:
+          code = known[field][value] = len(self.values[field])
+          self.values[field].append(value)
+        column.append(code)
+      for field, column in self.texts.items():
+        cell = cells.get(column_ids[field])
+        column.append(texts[field] if cell is None else cell.display_value)
+
+  def __len__(self) -> int:
+    return len(self.rows)
+
+  def missing(self, field:str) -> Iterable[bool]:
+    """ Mask of the rows without a date in field """
+    return map(eq, self.dates[field], repeat(NO_DATE))
+
+  def between(self, field:str, after:date|None=None, before:date|None=None) -> Iterable[bool]:
+    """ Mask of the rows with a date in field strictly between after and before """
+    masks = [map(lt, self.dates[field], repeat(NO_DATE))]
+    if after is not None:
+      masks.append(map(lt, repeat(after.toordinal()), self.dates[field]))
+    if before is not None:
+      masks.append(map(lt, self.dates[field], repeat(before.toordinal())))
+    return ColumnarView.all_of(masks)
+
+  def among(self, field:str, values:Iterable[Any]) -> Iterable[bool]:
+    """ Mask of the rows whose value in field is one of values """
+    values = set(values)
+    wanted = {i for i, x in enumerate(self.values[field]) if x in values}
+    return map(wanted.__contains__, self.codes[field])
+
+  def select(self, masks:List[Iterable[bool]]) -> List[int]:
+    """ Positions of the rows set in every mask, all rows without masks """
+    if len(masks) == 0:
+      return list(range(len(self.rows)))
+    return list(compress(range(len(self.rows)), ColumnarView.all_of(masks)))
+
+  def sort(self, positions:List[int], field:str) -> List[int]:
+    """ Positions by the date in field, missing dates last, equal dates in sheet order """
+    return sorted(positions, key=self.dates[field].__getitem__)
+
+  def position(self, row_id:int) -> int:
+    if self.positions is None:
+      self.positions = {x:i for i, x in enumerate(self.row_ids)}
+    return self.positions[row_id]
+
+  def date_str(self, field:str, position:int) -> str|None:
+    ordinal = self.dates[field][position]
+    return None if ordinal == NO_DATE else date.fromordinal(ordinal).isoformat()
+
+  def value(self, field:str, position:int) -> Any:
+    """ Value of a picklist or text column """
+    if field in self.codes:
+      return self.values[field][self.codes[field][position]]
+    return self.texts[field][position]
+
+  @staticmethod
+  def all_of(masks:List[Iterable[bool]]) -> Iterable[bool]:
+    return reduce(lambda a, b: map(and_, a, b), masks)
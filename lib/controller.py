@@ -1,70 +1,198 @@
-from . import Database, Todo, Util, TodoFilterType
-from typing import List
+from . import Database, Todo, Util, TodoFilterType, TodoSelectorFilter, Importer, Exporter, Mirror, Archive, Shards, Snapshot, Table, Stats, ScheduledSmartsheet
+from typing import Any, Iterator, List
+from contextlib import contextmanager, ExitStack
+from .todo import LIST_COLUMNS
+from .exporter import FORMATS, EXPORT_COLUMNS
 from operator import methodcaller
+from time import monotonic
+
+# todos per page of ls --page without --limit
+LIST_PAGE_SIZE = 50
 
 class Controller:
 
-    def __init__(self, db:Database, table_name:str, folder_id:str|None=None) -> None:
+    def __init__(self, db:Database, table_name:str, folder_id:str|None=None, mirror:Mirror|None=None, archive_after_days:int|None=None, shard_keys:List[str]|None=None, snapshot:Snapshot|None=None, defer:bool=False) -> None:
+        """ defer loads the sheets in the background, commands wait for it except list, which may render the snapshot """
         self.db = db
         self.table_name = table_name
         self.folder_id = folder_id
+        self.mirror = mirror
+        self.archive_after_days = archive_after_days
+        self.archived = Archive(db, table_name, folder_id)
+        self.shards = Shards(db, table_name, shard_keys)
+        # list and see append their todos here instead of printing them when set, see app.py --json
+        self.output:List[dict[str, Any]]|None = None
+        # mirror writes of the todos changed inside batch, done once it committed
+        self.deferred:List[tuple[Table, List[Todo]]] = []
+        self.snapshot = snapshot
+        self.started = self.db.executor.submit(self._start) if defer else None
+        if not defer:
+            self._start()
+
+    def _start(self) -> None:
         # if folder is set and table does not exist, create sheet
-        table = self.db.find_table(self.table_name)
-        if self.folder_id and table is None:
+        tables = self._tables()
+        if self.folder_id and len(tables) < len(self.shards.names()):
             print("Creating table/sheet in that folder...")
-            Todo.create_table(self.db.smart, self.table_name, self.folder_id)
+            self.shards.create_missing(self.folder_id)
+            tables = self._tables()
+            if len(tables) < len(self.shards.names()) and self.db.error is not None:
+                print(f"Unable to create the missing sheets: {self.db.error.result.message}")
+        if self.archive_after_days is not None:
+            for table in tables:
+                self._archive(table, self.archive_after_days)
+        # the copy left by the last run is kept while no shard changed since
+        if self.mirror is not None and len(tables) and not self.mirror.is_current(tables):
+            self.mirror.sync(tables)
+        if self.snapshot is not None:
+            self.db.executor.submit(self.snapshot.save, tables)
+
+    def wait_started(self) -> None:
+        """ Wait for the deferred load of the sheets """
+        if self.started is not None:
+            started, self.started = self.started, None
+            started.result()
 
-    def list(self, commands:List[str]) -> None:
+    def list(self, commands:List[str]) -> bool:
+        fresh = "--fresh" in commands
+        commands = [x for x in commands if x != "--fresh"]
+        try:
+            commands, start, stop = Controller._page(commands)
+        except ValueError:
+            print("--limit and --page take a number above 0")
+            return False
         if (commands[0] == "la") or (len(commands) > 1 and commands[1] == "-a"):
             todo_filter = TodoFilterType.ALL
         elif (commands[0] == "week"):
             todo_filter = TodoFilterType.WEEK
+        elif (commands[0] == "overdue"):
+            todo_filter = TodoFilterType.OVERDUE
         else:
             todo_filter = TodoFilterType.UNFINISHED
+        line = " ".join(x for x in commands[1:] if x != "-a")
+        args = Util.parse_args(line) if ":" in line else {}
+        status = args.get("status")
+        try:
+            after = Util.parse_date(args["after"]) if args.get("after") else None
+            before = Util.parse_date(args["before"]) if args.get("before") else None
+        except ValueError:
+            print("Dates must look like 2023-12-12")
+            return False
 
-        todos = Todo.create_print_table(self.db.find_table(self.table_name), todo_filter)
-        Util.print_table(todos)
-
-    def see(self, id:str) -> None:
-        found = self._find_matching(self.db, id, self.table_name)
-        if found is not None:
-            print(found.pretty_str())
+        if self.started is not None and not self.started.done() and self.mirror is None and self.snapshot is not None and not fresh:
+            cached = self.snapshot.load()
+            if cached is not None:
+                print("(last known todos, the sheet is still loading)")
+                self._show_table(Controller._slice(Todo.print_table(cached, todo_filter, status, after, before), start, stop))
+                return True
+        self.wait_started()
+        # the archive loads while the sheet is read
+        archived = self.db.executor.submit(self.archived.print_rows, status, after, before, stop) if todo_filter == TodoFilterType.ALL else None
+        # only the todos up to the page shown are made
+        if self.mirror is not None:
+            todos = self.mirror.create_print_table(todo_filter, status, after, before, stop)
         else:
-            print(f"Unable to find with id {id}")
+            tables = self._tables(fresh=fresh)
+            self._show_age(tables)
+            todos = Todo.create_print_table(tables, todo_filter, status, after, before, stop)
+            if self.snapshot is not None:
+                self.db.executor.submit(self.snapshot.save, tables)
+        if archived is not None:
+            # archived todos are all completed, they follow the ones still in the sheet
+            todos += archived.result()
+        self._show_table(Controller._slice(todos, start, stop))
+        return True
 
-    def run_generic_command(self, command:str, id:str) -> None:
-        found = self._find_matching(self.db, id, self.table_name)
-        if found is not None:
-            if command == "rm" or command == "remove":
-                command = "delete"
-            methodcaller(command)(found)
+    def see(self, id:str, fresh:bool=False) -> bool:
+        self.wait_started()
+        if self.mirror is not None:
+            found = self.mirror.find_by_id(id)
         else:
-            print(f"Unable to find with id {id}")
-
-    def set_attribute(self, commands:List[str]) -> None:
-        id = commands[1]
-        found = self._find_matching(self.db, id, self.table_name)
+            tables = self._tables(None, fresh)
+            self._show_age(tables)
+            found = Todo.find_by_id(tables, id)
+        if found is None:
+            found = self.archived.find_by_id(id)
         if found is None:
             print(f"Unable to find with id {id}")
-            return
+            return False
+        if self.output is not None:
+            self.output.append(found.as_dict())
+        else:
+            print(found.pretty_str())
+        return True
+
+    def search(self, commands:List[str]) -> bool:
+        query = " ".join(commands[1:]).strip()
+        if query == "":
+            print("Please give some terms to search for")
+            return False
+        self.wait_started()
+        # the notes are searched as well, the sheet is read with all its columns
+        tables = self._tables(None)
+        self._show_age(tables)
+        self._show_table(Todo.create_search_table(tables, query))
+        return True
+
+    def run_generic_command(self, command:str, selectors:List[str]) -> bool:
+        self.wait_started()
+        todos, ok = self._find_targets(" ".join(selectors))
+        if len(todos) == 0:
+            return ok
+        if command == "rm" or command == "remove" or command == "delete":
+            for table, found in self._by_table(todos).items():
+                ids = [x.row.id for x in found]
+                table.delete_row(ids)
+                if self.mirror is not None:
+                    # rows whose delete failed are still in the sheet
+                    kept = {x.id for x in table.find_rows(ids)}
+                    self.mirror.delete([x for x in ids if x not in kept])
+            return ok
+        for table, found in self._by_table(todos).items():
+            with table.batch():
+                for todo in found:
+                    methodcaller(command)(todo)
+            self._write_through(table, found)
+        return ok
+
+    def set_attribute(self, commands:List[str]) -> bool:
+        self.wait_started()
+        separator = self._separator(commands)
+        if separator is not None:
+            selectors = " ".join(commands[1:separator])
+            line = " ".join(commands[separator + 1:])
+        else:
+            # leading ids and ranges, then the values to set
+            first = self._first_assignment(commands)
+            selectors = " ".join(commands[1:first])
+            line = " ".join(commands[first:])
+        todos, ok = self._find_targets(selectors)
+        if len(todos) == 0:
+            return ok
 
-        args = Util.parse_args(" ".join(commands[2:]))
+        args = Util.parse_args(line)
         due_date = args.get("due_date", None)
         if due_date is None:
             due_date = args.get("date", None)
         task = args.get("task", None)
         notes = args.get("notes", None)
         status = args.get("status", None)
-        if due_date is not None:
-            found.update_due_date_as_str(due_date)
-        if task is not None:
-            found.update_task(task)
-        if notes is not None:
-            found.update_notes(notes)
-        if status is not None:
-            found.update_status(status)
+        for table, found in self._by_table(todos).items():
+            with table.batch():
+                for todo in found:
+                    if due_date is not None:
+                        todo.update_due_date_as_str(due_date)
+                    if task is not None:
+                        todo.update_task(task)
+                    if notes is not None:
+                        todo.update_notes(notes)
+                    if status is not None:
+                        todo.update_status(status)
+            self._write_through(table, found)
+        return ok
 
-    def create(self, commands:List[str]) -> None:
+    def create(self, commands:List[str]) -> bool:
+        self.wait_started()
         args = Util.parse_args(" ".join(commands[1:]))
         notes = args.get("notes", None)
         task = args.get("task", None)
@@ -74,19 +202,156 @@ class Controller:
         if due_date is not None:
             due_date = Util.parse_date(due_date)
         if task is not None:
-            todo = Todo(self.db.find_table(self.table_name), task, due_date, notes)
+            table = self.shards.table_for_new(args.get("shard", None), due_date, self._columns())
+            if table is None:
+                print(f"Unable to find table {self.table_name}, or shard {args.get('shard', None)} in {self.shards.keys}")
+                return False
+            row_count = len(table.rows)
+            todo = Todo(table, task, due_date, notes)
             todo.save()
-        else:
-            print("You need task and optionally due_date")
+            self._write_through_new(table, row_count)
+            return len(table.rows) > row_count
+        print("You need task and optionally due_date")
+        return False
+
+    def import_file(self, commands:List[str]) -> bool:
+        self.wait_started()
+        if len(commands) < 2:
+            print("You need a .csv or .jsonl file")
+            return False
+        file_name = " ".join(commands[1:])
+        table = self.shards.table_for_new(columns=self._columns())
+        if table is None:
+            print(f"Unable to find table {self.table_name}")
+            return False
+        row_count = len(table.rows)
+        try:
+            report = Importer.import_file(table, file_name)
+            print(report)
+        except OSError as e:
+            print(f"Unable to read {file_name}: {e}")
+            return False
+        finally:
+            self._write_through_new(table, row_count)
+        return report.failed == 0
+
+    def export(self, commands:List[str]) -> bool:
+        if len(commands) < 3 or commands[1] not in FORMATS:
+            print(f"Usage: export {'|'.join(FORMATS)} <file>")
+            return False
+        file_name = " ".join(commands[2:])
+        self.wait_started()
+        if self.db.journal is not None:
+            # the sheet is read as it is, the writes still waiting go first
+            self.db.journal.flush()
+        # page by page straight from the sheets, the loaded tables are left alone
+        pages = (table for name in self.shards.names() for table in self.db.stream_table(name, EXPORT_COLUMNS))
+        try:
+            count = Exporter.export(Todo.stream(pages), file_name, commands[1])
+        except OSError as e:
+            print(f"Unable to write {file_name}: {e}")
+            return False
+        if self.db.error is not None:
+            print(f"Exported {count} todos to {file_name} before the sheet stopped answering: {self.db.error.result.message}")
+            return False
+        print(f"Exported {count} todos to {file_name}")
+        return True
+
+    def sync(self) -> bool:
+        self.wait_started()
+        if self.mirror is None:
+            print("No local mirror configured, set SQLITE_MIRROR")
+            return False
+        tables = self._tables(None)
+        if len(tables):
+            self.mirror.sync(tables)
+        return len(tables) > 0
+
+    def archive(self, commands:List[str]) -> bool:
+        self.wait_started()
+        days = self.archive_after_days
+        if len(commands) > 1:
+            try:
+                days = int(commands[1])
+            except ValueError:
+                print("Days must be a whole number")
+                return False
+        if days is None:
+            print("You need the number of days, or set ARCHIVE_AFTER_DAYS")
+            return False
+        tables = self._tables()
+        if len(tables) == 0:
+            print(f"Unable to find table {self.table_name}")
+            return False
+        return all([self._archive(table, days) for table in tables])
+
+    def prefetch(self) -> None:
+        """ Load the sheets in the background, the next command finds them cached """
+        if self.mirror is None and (self.started is None or self.started.done()):
+            self.shards.prefetch(self._columns())
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """ Coalesce the set, finish and unfinish commands run inside into one commit per sheet """
+        self.wait_started()
+        with ExitStack() as stack:
+            for table in self._tables():
+                stack.enter_context(table.batch())
+            yield
+        deferred, self.deferred = self.deferred, []
+        for table, todos in deferred:
+            self._write_through(table, todos)
+
+    def take_errors(self) -> List[str]:
+        """ Messages of the writes that failed since the last call """
+        errors = []
+        for table in list(self.db.tables.values()):
+            errors += table.errors
+            table.errors = []
+        return errors
+
+    def prompt(self) -> str:
+        """ The prompt, telling about the writes not sent yet when writing behind """
+        if self.db.journal is None:
+            return "> "
+        self.db.journal.settle()
+        pending, failed = self.db.journal.counts()
+        if pending == 0:
+            return "> "
+        if failed == 0:
+            return f"[{pending} pending] > "
+        return f"[{pending} pending, {failed} failed] > "
+
+    def stats(self) -> None:
+        for table in Stats.report():
+            if len(table) > 1:
+                Util.print_table(table)
+                print()
+        if isinstance(self.db.smart, ScheduledSmartsheet):
+            metrics = self.db.smart.scheduler.metrics()
+            Util.print_table([list(metrics.keys()), [str(round(x, 3)) for x in metrics.values()]])
+        if self.db.journal is not None:
+            for message in sorted(set(dict(self.db.journal.errors).values())):
+                print(f"Writes waiting for a retry: {message}")
+        if self.db.webhooks is not None:
+            print(f"Sheets kept up to date by webhooks: {len(self.db.pushed)}")
+            for message in self.db.webhooks.errors:
+                print(message)
 
     def help(self) -> None:
         help = ('''Commands:
         help - see this help
-        ls - list uncompleted todos
+        ls - list uncompleted todos, ls, la, week and see take --fresh to check the sheet first when SHEET_REFRESH_INTERVAL is set
         la - list all (uncompleted and completed) todos
         week - list uncompleted todos that are due this week
+        overdue - list uncompleted todos due before today
+        due after:2023-12-01 before:2024-01-01 - list uncompleted todos due between the dates, either may be left out
+        ls, la, week, overdue and due take status:"In Progress" to only list todos with that status
+        ls, la, week, overdue and due take --limit 20 to list the first 20 todos, and --page 3 for the 3rd page of them, 50 per page by default
         see <id> - see the todo
+        search <terms> - todos whose task or notes hold every term, best match first, "quoted words" match a phrase, foo* any word starting with foo
         create task:foo due_date:2023-12-12 notes:"Some notes" - create todo
+        create task:foo shard:2024 - create todo in a shard, by default the shard of the due date year or the last one
         set <id> due_date:2023-12-12 - set due date
         set <id> task:"Do something" - set task
         set <id> notes:"Some notes" - set notes
@@ -94,11 +359,149 @@ class Controller:
         rm <id> - delete todo
         finish <id> - mark as completed
         unfinish <id> - mark as uncompleted
+        rm, finish and unfinish take several ids, ranges and filters, e.g. finish 3 5..9 or rm status:"OBE"
+        set takes several ids and ranges, e.g. set 3..9 status:"Done", or filters before --, e.g. set status:"OBE" -- status:"Done"
+        archive [days] - move todos completed more than days ago (ARCHIVE_AFTER_DAYS by default) to the archive sheet, la and see still find them
+        stats - api calls, timings and command latencies of this session, why writes wait for a retry when SHEET_WRITE_BEHIND is set, and when SHEET_WEBHOOK_URL is set how many sheets their webhooks keep up to date and why a webhook failed
+        sync - refresh the local mirror, when SQLITE_MIRROR is set
+        import <file> - create todos from a .csv (with header) or .jsonl file, same keys as create and completed_at
+        export csv|jsonl <file> - write every todo to the file as the sheet is read page by page, import reads it back
         history - see ephemeral command history
-        clear - clear ephemeral command history''')
+        clear - clear ephemeral command history
+        Without the prompt: python app.py -c "finish 3; ls", python app.py script.txt or python app.py - < script.txt, add --json for json lines
+        python app.py --serve keeps one session for the other app.py processes of this host, they send it their commands''')
         print(help)
         
     # Helpers
 
-    def _find_matching(self, db:Database, id:str, table_name:str) -> Todo|None:
-        return Todo.find_by_id(db.find_table(table_name), id)
+    def _tables(self, columns:List[str]|None=LIST_COLUMNS, fresh:bool=False) -> List[Table]:
+        """ Every shard with only the columns the command needs, all of them when reading through the mirror """
+        if self.db.journal is not None:
+            self.db.journal.settle()
+        return self.shards.tables(self._columns(columns), fresh)
+
+    def _show_age(self, tables:List[Table]) -> None:
+        """ With the refresher running, tell how old the shown rows may be """
+        if self.db.refresher is None or len(tables) == 0:
+            return
+        age = monotonic() - min(x.checked_at for x in tables)
+        if age >= 1:
+            print(f"(as of {age:.0f}s ago, refreshing in the background, add --fresh to wait for the sheet)")
+
+    def _columns(self, columns:List[str]|None=LIST_COLUMNS) -> List[str]|None:
+        return None if self.mirror is not None else columns
+
+    def _show_table(self, todos:List[List[str]]) -> None:
+        if self.output is None:
+            Util.print_rows(todos)
+            return
+        keys = [x.lower() for x in todos[0]]
+        self.output.extend({k: None if v == "None" else v for k, v in zip(keys, row)} for row in todos[1:])
+
+    @staticmethod
+    def _page(commands:List[str]) -> tuple[List[str], int, int|None]:
+        """ Commands without --limit and --page, and the todos of the listing they ask for, raises ValueError when not a number above 0 """
+        options:dict[str, int] = {}
+        rest = []
+        i = 0
+        while i < len(commands):
+            if commands[i] in ["--limit", "--page"]:
+                value = int(commands[i + 1]) if i + 1 < len(commands) else 0
+                if value < 1:
+                    raise ValueError(commands[i])
+                options[commands[i]] = value
+                i += 2
+            else:
+                rest.append(commands[i])
+                i += 1
+        if len(options) == 0:
+            return rest, 0, None
+        limit = options.get("--limit", LIST_PAGE_SIZE)
+        start = (options.get("--page", 1) - 1) * limit
+        return rest, start, start + limit
+
+    @staticmethod
+    def _slice(todos:List[List[str]], start:int, stop:int|None) -> List[List[str]]:
+        """ Todos start to stop of a print table, with its header """
+        return todos[:1] + todos[1 + start:None if stop is None else 1 + stop]
+
+    def _by_table(self, todos:List[Todo]) -> dict[Table, List[Todo]]:
+        """ Groups todos by their shard, each gets its own batch """
+        grouped:dict[Table, List[Todo]] = {}
+        for todo in todos:
+            grouped.setdefault(todo.table, []).append(todo)
+        return grouped
+
+    def _find_targets(self, selectors:str) -> tuple[List[Todo], bool]:
+        """ Resolves ids, ranges and filters against a single load of the table, and whether all of them resolved """
+        try:
+            ids, filters = Util.parse_selectors(selectors)
+        except ValueError as e:
+            print(e)
+            return [], False
+        valid_filters = [x.value for x in TodoSelectorFilter]
+        unknown = [x for x in filters if x not in valid_filters]
+        if len(unknown):
+            print(f"Unknown filter {', '.join(unknown)}, valid filters are {valid_filters}")
+            return [], False
+        # an empty value would match every todo
+        empty = [x for x, value in filters.items() if value.strip() == ""]
+        if len(empty):
+            print(f"Filter {', '.join(empty)} needs a value, e.g. {empty[0]}:\"some text\"")
+            return [], False
+        if len(ids) == 0 and len(filters) == 0:
+            print("You need at least one id, range or filter")
+            return [], False
+        tables = self._tables()
+        todos, missing = Todo.find_all(tables, ids, filters)
+        # inside a batch, rows with staged changes and filters must see those changes first
+        if any(len(x.pending) for x in tables) and (len(filters) or any(x.row.id in x.table.pending for x in todos)):
+            for table in tables:
+                table.commit()
+            todos, missing = Todo.find_all(tables, ids, filters)
+        if len(missing):
+            print(f"Unable to find with id {', '.join(missing)}")
+        return todos, len(missing) == 0
+
+    def _archive(self, table:Table, days:int) -> bool:
+        moved, errors = self.archived.archive(table, days)
+        if self.mirror is not None:
+            self.mirror.delete(moved)
+        if len(moved):
+            print(f"Archived {len(moved)} todos to {self.archived.table_name}")
+        for error in errors:
+            print(f"Unable to archive: {error}")
+        return len(errors) == 0
+
+    def _write_through(self, table:Table, todos:List[Todo]) -> None:
+        """ Copy the rows as patched by the writes into the mirror """
+        if self.mirror is not None and table.batch_depth > 0:
+            self.deferred.append((table, todos))
+        elif self.mirror is not None:
+            updated = [Todo.find_by_id(table, x.id) for x in todos]
+            self.mirror.upsert([x for x in updated if x is not None])
+
+    def _write_through_new(self, table:Table, row_count:int) -> None:
+        """ Copy the rows added after the first row_count rows into the mirror """
+        if self.mirror is not None:
+            self.mirror.upsert(Todo._rows(table, table.rows[row_count:]))
+
+    def _separator(self, commands:List[str]) -> int|None:
+        """ Index of the first -- between the filters and the values of set, not one inside a quoted value """
+        quote = None
+        for i, x in enumerate(commands):
+            if i > 0 and x == "--" and quote is None:
+                return i
+            for char in x:
+                if quote is not None:
+                    if char == quote:
+                        quote = None
+                elif char in "'\"":
+                    quote = char
+        return None
+
+    def _first_assignment(self, commands:List[str]) -> int:
+        for i, x in enumerate(commands):
+            if i > 0 and ":" in x:
+                return i
+        return len(commands)
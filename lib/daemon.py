@@ -0,0 +1,92 @@
+from __future__ import annotations
+from typing import Any, Callable
+from threading import Lock
+import json
+import os
+import socket
+import socketserver
+
+class Daemon:
+  """ Serves one warm session to the clients of a Unix socket, one json object per line each way.
+  Requests run one at a time, a client keeps its own session state for as long as it stays connected """
+
+  def __init__(self, socket_path:str, handler:Callable[[dict[str, Any], dict[str, Any]], dict[str, Any]]) -> None:
+    """ handler is called with a request and the session of its client, returns the response """
+    self.socket_path = socket_path
+    self.handler = handler
+    self.lock = Lock()
+    daemon = self
+
+    class Connection(socketserver.StreamRequestHandler):
+      def handle(self) -> None:
+        session:dict[str, Any] = {}
+        for line in self.rfile:
+          try:
+            request = json.loads(line)
+          except ValueError:
+            response = {"output": "Unable to read the request\n", "status": 1}
+          else:
+            with daemon.lock:
+              response = daemon.handler(request, session)
+          self.wfile.write(json.dumps(response).encode() + b"\n")
+          self.wfile.flush()
+
+    self.connection_class = Connection
+    self.server:socketserver.ThreadingUnixStreamServer|None = None
+
+  def serve_forever(self) -> None:
+    """ Serve until interrupted, a socket file left by a daemon that died is replaced """
+    if os.path.exists(self.socket_path):
+      client = DaemonClient.connect(self.socket_path)
+      if client is not None:
+        client.close()
+        raise OSError(f"A daemon is already serving {self.socket_path}")
+      os.unlink(self.socket_path)
+    self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, self.connection_class)
+    self.server.daemon_threads = True
+    os.chmod(self.socket_path, 0o600)
+    try:
+      self.server.serve_forever()
+    finally:
+      self.server.server_close()
+      os.unlink(self.socket_path)
+
+  def shutdown(self) -> None:
+    if self.server is not None:
+      self.server.shutdown()
+
+class DaemonClient:
+  """ Connection of a thin app.py to a Daemon """
+
+  def __init__(self, connection:socket.socket) -> None:
+    self.connection = connection
+    self.file = connection.makefile("rwb")
+
+  @staticmethod
+  def connect(socket_path:str) -> DaemonClient|None:
+    """ None when no daemon serves the socket """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      connection.connect(socket_path)
+    except OSError:
+      connection.close()
+      return None
+    return DaemonClient(connection)
+
+  def request(self, message:dict[str, Any]) -> dict[str, Any]:
+    self.file.write(json.dumps(message).encode() + b"\n")
+    self.file.flush()
+    line = self.file.readline()
+    if not line:
+      raise ConnectionError("The daemon closed the connection")
+    return json.loads(line)
+
+  def close(self) -> None:
+    self.file.close()
+    self.connection.close()
+
+  def __enter__(self) -> DaemonClient:
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
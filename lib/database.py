@@ -1,21 +1,381 @@
-from smartsheet import Smartsheet
-from typing import List
-from . import Table
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterator, List
+from time import monotonic
+from datetime import datetime, timedelta, timezone
+from os import path
+from concurrent.futures import Future
+from threading import Event, Lock, Thread
+from . import Table, SheetResolver, Stats, Executor, Journal, Util, WebhookReceiver
+if TYPE_CHECKING:
+  from smartsheet import Smartsheet
+  from smartsheet.models.column import Column
+
+NOT_FOUND = 404
+# rows modified this long before the last sync are fetched again, covers clock skew
+SYNC_OVERLAP = timedelta(minutes=1)
+# rows per get_sheet call of a streamed sheet, see stream_table
+PAGE_SIZE = 1000
+# row ids of a get_sheet call go in the url, see _pull_changes
+MAX_ROW_IDS_PER_FETCH = 400
 
 class Database:
   """ Represents datastore """
 
-  def __init__(self, smart:Smartsheet) -> None:
+  def __init__(self, smart:Smartsheet, cache_ttl:float=0, cache_dir:str|None=None, incremental:bool=False, executor:Executor|None=None) -> None:
     self.smart = smart
+    self.cache_ttl = cache_ttl
+    self.cache_dir = cache_dir
+    self.incremental = incremental
+    self.tables:dict[int, Table] = {}
+    self.columns:dict[int, List[Column]] = {}
+    self.error = None
+    self.resolver = SheetResolver(smart, self._cache_file(".sheet_ids.json"))
+    self.executor = executor or Executor()
+    # one load of a sheet at a time, a second caller waits and gets the cached table
+    self.lock = Lock()
+    self.sheet_locks:dict[int, Lock] = {}
+    # when running, cached tables are served as they are and revalidated in the background
+    self.refresher:Refresher|None = None
+    # when set, writes patch the cached tables and are sent in the background
+    self.journal:Journal|None = None
+    # when set, webhooks tell about the changes of the sheets, see start_webhooks
+    self.webhooks:WebhookReceiver|None = None
+    # sheet id -> monotonic time a webhook started telling about its changes, see watch
+    self.pushed:dict[int, float] = {}
+    # sheet id -> (row ids changed, row ids deleted) told by its webhook, fetched by the next read
+    self.changes:dict[int, tuple[set[int], set[int]]] = {}
+    self.changes_lock = Lock()
+
+  def find_table(self, table_name:str, columns:List[str]|None=None, fresh:bool=False) -> Table|None:
+    """ columns limits the download to the columns a command needs, None fetches them all,
+    fresh checks the sheet version even when the refresher is running """
+    with Stats.phase("find_table"):
+      return self._find_table(table_name, columns, fresh)
+
+  def find_table_async(self, table_name:str, columns:List[str]|None=None) -> Future:
+    """ find_table run by the executor, e.g. to load the sheet while the user is typing """
+    return self.executor.submit(self.find_table, table_name, columns)
+
+  def find_tables(self, table_names:List[str], columns:List[str]|None=None, fresh:bool=False) -> List[Table|None]:
+    """ Several tables fetched concurrently, in the order of their names """
+    return self.executor.map(lambda x: self.find_table(x, columns, fresh), table_names)
+
+  def _find_table(self, table_name:str, columns:List[str]|None, fresh:bool) -> Table|None:
+    sheet_id = self.resolver.resolve(table_name)
+    if sheet_id is None:
+      return None
+    table = self.get_table(sheet_id, columns, fresh)
+    # cached id points to a sheet that is gone, look it up again
+    if table is None and self._not_found() and self.resolver.forget(table_name):
+      sheet_id = self.resolver.resolve(table_name)
+      if sheet_id is not None:
+        table = self.get_table(sheet_id, columns, fresh)
+    return table
+
+  def create_missing(self, table_name:str) -> bool:
+    """ Whether the sheet is known not to exist and may be created, not when listing the sheets failed """
+    if self.resolver.resolve(table_name) is not None:
+      return False
+    if self.resolver.error is not None:
+      self.error = self.resolver.error
+      return False
+    return True
+
+  def is_cached(self, table_name:str, columns:List[str]|None=None) -> bool:
+    """ Whether the table is cached with the columns, without a request """
+    sheet_id = self.resolver.ids.get(table_name)
+    table = None if sheet_id is None else self.tables.get(sheet_id)
+    return table is not None and not table.stale and table.has_columns(columns)
+
+  def get_table(self, sheet_id:int, columns:List[str]|None=None, fresh:bool=False) -> Table|None:
+    """ Cached table, only downloaded again when the sheet version has changed or columns are missing """
+    with self._sheet_lock(sheet_id):
+      return self._get_table(sheet_id, columns, fresh)
+
+  def _get_table(self, sheet_id:int, columns:List[str]|None, fresh:bool) -> Table|None:
+    table = self.tables.get(sheet_id)
+    if table is not None and not table.stale and table.has_columns(columns):
+      # its webhook tells about every change made since the table was last checked
+      if not fresh and table.checked_at >= self.pushed.get(sheet_id, float("inf")) and self._pull_changes(table):
+        return table
+      if monotonic() - table.checked_at < self.cache_ttl:
+        return table
+      if self.refresher is not None and not fresh:
+        self.refresher.wake(sheet_id)
+        return table
+      response = self.smart.Sheets.get_sheet_version(sheet_id)
+      if isinstance(response, self.smart.models.Error):
+        self.error = response
+        # a sheet that is gone is looked up again, otherwise the cached table is served until the sheet answers
+        if not self._not_found():
+          return table
+      elif response.version == table.version:
+        table.checked_at = monotonic()
+        return table
+      elif self.incremental and self._sync(table):
+        return table
+
+    if table is not None:
+      # keep the columns already loaded, one download covers both
+      columns = None if columns is None or table.projection is None else list(table.projection | set(columns))
+    return self._load(sheet_id, columns)
+
+  def _load(self, sheet_id:int, columns:List[str]|None) -> Table|None:
+    table = self._fetch(sheet_id, columns)
+    if table is None:
+      self.tables.pop(sheet_id, None)
+    else:
+      self.tables[sheet_id] = table
+    return table
+
+  def stream_table(self, table_name:str, columns:List[str]|None=None, page_size:int=PAGE_SIZE) -> Iterator[Table]:
+    """ The sheet a page of rows at a time, each page a Table of its own that is not cached,
+    the next page downloads while the caller works through the current one """
+    sheet_id = self.resolver.resolve(table_name)
+    if sheet_id is None:
+      return
+    projection = self._projection(sheet_id, columns)
+    if projection is None:
+      return
+    all_columns, column_ids = projection
+    fetch = lambda page: self.smart.Sheets.get_sheet(sheet_id, column_ids=column_ids, page_size=page_size, page=page)
+    page = 1
+    upcoming = self.executor.submit(fetch, page)
+    while upcoming is not None:
+      sheet = upcoming.result()
+      if isinstance(sheet, self.smart.models.Error):
+        self.error = sheet
+        return
+      self.error = None
+      more = len(sheet.rows) == page_size and page * page_size < (sheet.total_row_count or 0)
+      page += 1
+      upcoming = self.executor.submit(fetch, page) if more else None
+      yield Table(self.smart, sheet, all_columns, columns, self.executor)
+
+  def _projection(self, sheet_id:int, columns:List[str]|None) -> tuple[List[Column]|None, List[int]|None]|None:
+    """ All columns of the sheet and the ids of the ones to download, both None for all of them, None when unknown """
+    if columns is None:
+      return None, None
+    all_columns = self._columns(sheet_id)
+    if all_columns is None:
+      return None
+    return all_columns, [x.id for x in all_columns if x.title in columns]
+
+  def _fetch(self, sheet_id:int, columns:List[str]|None) -> Table|None:
+    projection = self._projection(sheet_id, columns)
+    if projection is None:
+      return None
+    all_columns, column_ids = projection
+    synced_at = datetime.now(timezone.utc)
+    sheet = self.smart.Sheets.get_sheet(sheet_id, column_ids=column_ids)
+    if isinstance(sheet, self.smart.models.Error):
+      self.error = sheet
+      return None
+    self.error = None
+    table = Table(self.smart, sheet, all_columns, columns, self.executor)
+    table.synced_at = synced_at
+    table.on_write = self._written
+    table.text_index_file = self._cache_file(f".search_{sheet_id}.json")
+    if self.journal is not None:
+      table.journal = self.journal
+      self.journal.replay(table)
+    return table
+
+  def start_refresher(self, interval:float) -> None:
+    """ Revalidate the cached tables every interval seconds and right after writes """
+    if self.refresher is None:
+      self.refresher = Refresher(self, interval)
+      self.refresher.start()
+
+  def stop_refresher(self) -> None:
+    if self.refresher is not None:
+      self.refresher.stop()
+      self.refresher = None
+
+  def start_journal(self, file_name:str) -> Journal:
+    """ Write behind through a journal kept in file_name, sending what an earlier run left in it """
+    if self.journal is None:
+      self.journal = Journal(self, file_name)
+      for table in self.tables.values():
+        table.journal = self.journal
+        self.journal.replay(table)
+      self.journal.start()
+    return self.journal
 
-  def find_table(self, table_name:str) -> Table|None:
-    response = self.smart.Sheets.list_sheets()
-    todos = list(filter(lambda x: x.name == table_name, response.data))
-    if len(todos):
-      todo = list(filter(lambda x: x.name == table_name, response.data))[0]
-      return Table(self.smart, self.smart.Sheets.get_sheet(todo.id))
-    return None
+  def start_webhooks(self, callback_url:str, port:int, table_names:List[str]) -> WebhookReceiver:
+    """ Serve webhook callbacks on port, reached by Smartsheet at callback_url, and register the webhooks of the sheets,
+    reads of a sheet whose webhook is enabled only fetch the rows it told about """
+    if self.webhooks is None:
+      self.webhooks = WebhookReceiver(self, callback_url, port)
+      self.webhooks.start()
+      self.webhooks.register(table_names)
+    return self.webhooks
+
+  def watch(self, sheet_id:int, pushed:bool) -> None:
+    """ Whether a webhook tells about the changes of the sheet, its cached table is then read without checking the version,
+    once checked after the webhook started """
+    with self.changes_lock:
+      if pushed:
+        self.pushed[sheet_id] = monotonic()
+      else:
+        self.pushed.pop(sheet_id, None)
+        self.changes.pop(sheet_id, None)
+
+  def changed(self, sheet_id:int, rows:set[int], deleted:set[int], whole:bool=False) -> None:
+    """ Rows of the sheet changed or deleted by someone, fetched again by the next read, the whole sheet when whole """
+    with self.changes_lock:
+      if whole:
+        self.changes.pop(sheet_id, None)
+        self.invalidate(sheet_id)
+        return
+      changed, gone = self.changes.setdefault(sheet_id, (set(), set()))
+      gone |= deleted
+      changed |= rows
+      changed -= gone
+
+  def _pull_changes(self, table:Table) -> bool:
+    """ Fetch the rows its webhook told about into the table, returns whether it worked """
+    with self.changes_lock:
+      changed, deleted = self.changes.pop(table.id, (set(), set()))
+    if len(changed) == 0 and len(deleted) == 0:
+      return True
+    rows = []
+    version = table.version
+    for chunk in Util.chunks(list(changed), MAX_ROW_IDS_PER_FETCH):
+      sheet = self.smart.Sheets.get_sheet(table.id, row_ids=chunk, column_ids=table.projected_column_ids())
+      if isinstance(sheet, self.smart.models.Error):
+        return False
+      rows += sheet.rows
+      version = sheet.version
+    # rows deleted since the event are no longer returned
+    deleted |= changed - {x.id for x in rows}
+    table.apply_changes(rows, deleted, version)
+    if self.journal is not None:
+      # the rows may hold cells patched by writes not sent yet
+      self.journal.replay(table)
+    return True
+
+  def refresh(self, sheet_id:int) -> None:
+    """ Download a cached table again when its sheet changed, swapped in whole so readers never see it half updated """
+    table = self.tables.get(sheet_id)
+    if table is None:
+      return
+    response = self.smart.Sheets.get_sheet_version(sheet_id)
+    if isinstance(response, self.smart.models.Error):
+      return
+    if response.version == table.version and not table.stale:
+      table.checked_at = monotonic()
+      return
+    new_table = self._fetch(sheet_id, None if table.projection is None else list(table.projection))
+    with self._sheet_lock(sheet_id):
+      current = self.tables.get(sheet_id)
+      # keep a table with writes in flight, or patched by writes newer than the download
+      if new_table is None or current is None or current.batch_depth > 0 or len(current.pending):
+        return
+      if current.stale or new_table.version >= current.version:
+        self.tables[sheet_id] = new_table
+
+  def _columns(self, sheet_id:int) -> List[Column]|None:
+    """ All columns of the sheet, fetched once """
+    if sheet_id not in self.columns:
+      response = self.smart.Sheets.get_columns(sheet_id, include_all=True)
+      if isinstance(response, self.smart.models.Error):
+        self.error = response
+        return None
+      self.columns[sheet_id] = response.data
+    return self.columns[sheet_id]
+
+  def _sync(self, table:Table) -> bool:
+    """ Merge rows modified since the last sync and drop deleted ones, returns whether it worked """
+    synced_at = datetime.now(timezone.utc)
+    since = (table.synced_at - SYNC_OVERLAP).isoformat(timespec="seconds")
+    delta = self.smart.Sheets.get_sheet(table.id, rows_modified_since=since, column_ids=table.projected_column_ids())
+    if isinstance(delta, self.smart.models.Error):
+      return False
+    table.apply_delta(delta.rows, None, delta.version)
+    # the delta holds every row added since, as many rows as the sheet means none was deleted,
+    # unless writes not sent yet make up for them
+    if len(table.rows) != delta.total_row_count or (self.journal is not None and self.journal.holds(table.id)):
+      # a single column without empty cells is the cheapest way to learn which rows still exist
+      primary = [x.id for x in delta.columns if x.primary] or [delta.columns[0].id]
+      live = self.smart.Sheets.get_sheet(table.id, column_ids=primary[:1], exclude="nonexistentCells")
+      if isinstance(live, self.smart.models.Error):
+        return False
+      table.apply_delta([], set(map(lambda x: x.id, live.rows)), delta.version)
+    table.synced_at = synced_at
+    if self.journal is not None:
+      # the delta may hold rows patched by writes not sent yet
+      self.journal.replay(table)
+    return True
+
+  def invalidate(self, sheet_id:int|None=None) -> None:
+    """ Download cached tables again on their next read, all of them when no sheet id is given """
+    for table in (list(self.tables.values()) if sheet_id is None else filter(None, [self.tables.get(sheet_id)])):
+      table.stale = True
+    if sheet_id is None:
+      self.columns.clear()
+    else:
+      self.columns.pop(sheet_id, None)
 
   def list_tables(self) -> List[str]:
-    response = self.smart.Sheets.list_sheets()
-    return (map(lambda x: x.name, response.data))
+    return list(map(lambda x: x.name, self.resolver.iter_sheets()))
+
+  def _written(self, table:Table) -> None:
+    if self.refresher is not None:
+      self.refresher.wake(table.id)
+
+  def _sheet_lock(self, sheet_id:int) -> Lock:
+    with self.lock:
+      return self.sheet_locks.setdefault(sheet_id, Lock())
+
+  def _not_found(self) -> bool:
+    return self.error is not None and self.error.result.status_code == NOT_FOUND
+
+  def _cache_file(self, name:str) -> str|None:
+    if self.cache_dir is None:
+      return None
+    return path.join(self.cache_dir, name)
+
+class Refresher:
+  """ Background thread of Database.start_refresher """
+
+  def __init__(self, db:Database, interval:float) -> None:
+    self.db = db
+    self.interval = interval
+    self.event = Event()
+    self.lock = Lock()
+    # sheets to revalidate before the next scheduled round
+    self.due:set[int] = set()
+    self.stopped = False
+    self.thread = Thread(target=self._run, name="refresher", daemon=True)
+
+  def start(self) -> None:
+    self.thread.start()
+
+  def stop(self) -> None:
+    self.stopped = True
+    self.event.set()
+
+  def wake(self, sheet_id:int) -> None:
+    with self.lock:
+      self.due.add(sheet_id)
+    self.event.set()
+
+  def _run(self) -> None:
+    while not self.stopped:
+      woken = self.event.wait(self.interval)
+      self.event.clear()
+      with self.lock:
+        due, self.due = self.due, set()
+      if self.stopped:
+        return
+      # every cached table on schedule, only the ones asked for when woken
+      for sheet_id in (due if woken else list(self.db.tables.keys())):
+        if sheet_id in self.db.pushed:
+          # its webhook tells about the changes, see Database.watch
+          continue
+        try:
+          self.db.refresh(sheet_id)
+        except Exception:
+          # a failed round is retried on the next one
+          pass
@@ -0,0 +1,33 @@
+from typing import Any, Callable, Iterable, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from threading import local
+
+# requests in flight at once, the RequestScheduler still paces them to the rate limit
+DEFAULT_WORKERS = 4
+
+class Executor:
+  """ Bounded pool running independent Smartsheet requests concurrently """
+
+  def __init__(self, workers:int=DEFAULT_WORKERS) -> None:
+    self.workers = max(1, workers)
+    self.local = local()
+    self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="smartsheet", initializer=self._mark_worker)
+
+  def submit(self, func:Callable, *args, **kwargs) -> Future:
+    """ func runs in a copy of the caller's context, its api calls are counted for the command that submitted it """
+    return self.pool.submit(copy_context().run, func, *args, **kwargs)
+
+  def map(self, func:Callable, items:Iterable[Any]) -> List[Any]:
+    """ Results in the order of items, run inline from a worker so nested maps cannot starve the pool """
+    items = list(items)
+    if len(items) < 2 or self.workers == 1 or getattr(self.local, "worker", False):
+      return list(map(func, items))
+    context = copy_context()
+    return list(self.pool.map(lambda x: context.copy().run(func, x), items))
+
+  def shutdown(self) -> None:
+    self.pool.shutdown(wait=False, cancel_futures=True)
+
+  def _mark_worker(self) -> None:
+    self.local.worker = True
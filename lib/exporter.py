@@ -0,0 +1,30 @@
+from typing import Iterable
+import csv
+import json
+from . import Todo
+from .todo import LIST_COLUMNS, TodoFieldNames
+
+FORMATS = ["csv", "jsonl"]
+# keys of Todo.as_dict, import reads the file back
+FIELDS = ["id", "task", "status", "due_date", "completed_at", "notes"]
+# columns a streamed sheet is downloaded with
+EXPORT_COLUMNS = LIST_COLUMNS + [TodoFieldNames.NOTES.value]
+
+class Exporter:
+  """ Writes todos to csv or jsonl files as they come, one at a time """
+
+  @staticmethod
+  def export(todos:Iterable[Todo], file_name:str, file_format:str) -> int:
+    """ Returns how many todos were written """
+    count = 0
+    with open(file_name, "w", newline="") as f:
+      if file_format == "csv":
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+      else:
+        write = lambda x: f.write(json.dumps(x) + "\n")
+      for todo in todos:
+        write(todo.as_dict())
+        count += 1
+    return count
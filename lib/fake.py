@@ -0,0 +1,360 @@
+from smartsheet import models
+from smartsheet.models import Sheet
+from typing import Any, List
+from datetime import datetime, timezone
+from time import sleep
+from threading import RLock
+from urllib import request
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import secrets
+
+RATE_LIMITED = {"statusCode": 429, "code": 4003, "message": "Rate limit exceeded.", "shouldRetry": True}
+NOT_FOUND = {"statusCode": 404, "code": 1006, "message": "Not Found", "shouldRetry": False}
+
+class FakeResponse:
+  """ Stands in for the requests response the SDK attaches to results """
+
+  def __init__(self, content:bytes) -> None:
+    self.content = content
+    self.status_code = 200
+
+class FakeSmartsheet:
+  """ In memory stand-in for the Smartsheet client, for benchmarks and offline runs """
+  models = models
+
+  def __init__(self, latency:float=0, rate_limit_rate:float=0, seed:int=0) -> None:
+    """ latency is added to every call, rate_limit_rate is the share of calls answered with 429 """
+    self.latency = latency
+    self.rate_limit_rate = rate_limit_rate
+    self.random = random.Random(seed)
+    self.ids = itertools.count(1000)
+    self.sheets:dict[int, dict[str, Any]] = {}
+    self.calls:dict[str, int] = {}
+    self.bytes = 0
+    # requests may come from several workers, the latency is spent outside the lock
+    self.lock = RLock()
+    self.Sheets = FakeSheets(self)
+    self.Folders = FakeFolders(self)
+    self.Webhooks = FakeWebhooks(self)
+
+  def seed_sheet(self, sheet_spec:Sheet, rows:List[dict[str, Any]]) -> int:
+    """ Create a sheet holding rows (column title -> value) without counting any calls """
+    sheet_id = self.create_sheet(sheet_spec.to_dict())
+    sheet = self.sheets[sheet_id]
+    title_to_id = {x["title"]:x["id"] for x in sheet["columns"]}
+    for row in rows:
+      self._append_row(sheet, {title_to_id[k]:v for k, v in row.items()})
+    return sheet_id
+
+  def edit_rows(self, sheet_id:int, changes:dict[int, dict[str, Any]]) -> None:
+    """ Change rows (row id -> column title -> value, None clears the cell) the way a teammate would,
+    without counting any calls, the webhooks of the sheet are told """
+    sheet = self.sheets[sheet_id]
+    title_to_id = {x["title"]:x["id"] for x in sheet["columns"]}
+    by_id = {x["id"]:x for x in sheet["rows"]}
+    events = []
+    with self.lock:
+      for row_id, values in changes.items():
+        for title, value in values.items():
+          if value is None:
+            by_id[row_id]["cells"].pop(title_to_id[title], None)
+          else:
+            by_id[row_id]["cells"][title_to_id[title]] = value
+          events.append({"objectType": "cell", "eventType": "updated", "rowId": row_id, "columnId": title_to_id[title]})
+        by_id[row_id]["modified"] = datetime.now(timezone.utc)
+        events.append({"objectType": "row", "eventType": "updated", "id": row_id})
+      sheet["version"] += 1
+    self.Webhooks.notify(sheet_id, events)
+
+  def reset_counters(self) -> None:
+    self.calls = {}
+    self.bytes = 0
+
+  def create_sheet(self, spec:dict[str, Any]) -> int:
+    sheet_id = next(self.ids)
+    columns = [dict(x, id=next(self.ids)) for x in spec["columns"]]
+    self.sheets[sheet_id] = {"id": sheet_id, "name": spec["name"], "version": 1, "columns": columns, "rows": [], "auto_number": 0}
+    return sheet_id
+
+  def _call(self, name:str) -> dict[str, Any]|None:
+    """ Count the call, returns the error to answer with if any """
+    with self.lock:
+      self.calls[name] = self.calls.get(name, 0) + 1
+      rate_limited = self.rate_limit_rate and self.random.random() < self.rate_limit_rate
+    if self.latency:
+      sleep(self.latency)
+    return RATE_LIMITED if rate_limited else None
+
+  def _respond(self, result:Any, payload:dict[str, Any]) -> Any:
+    content = json.dumps(payload).encode()
+    with self.lock:
+      self.bytes += len(content)
+    result.request_response = FakeResponse(content)
+    return result
+
+  def _append_row(self, sheet:dict[str, Any], cells:dict[int, Any]) -> dict[str, Any]:
+    with self.lock:
+      row = {"id": next(self.ids), "cells": cells, "modified": datetime.now(timezone.utc)}
+      for column in sheet["columns"]:
+        if column.get("systemColumnType") == "AUTO_NUMBER":
+          sheet["auto_number"] += 1
+          prefix = column.get("autoNumberFormat", {}).get("prefix", "")
+          cells[column["id"]] = f"{prefix}{sheet['auto_number']}"
+      sheet["rows"].append(row)
+      return row
+
+class FakeSheets:
+  """ The Sheets section of FakeSmartsheet """
+
+  def __init__(self, fake:FakeSmartsheet) -> None:
+    self.fake = fake
+
+  def list_sheets(self, include=None, page_size=None, page=None, include_all=None, modified_since=None):
+    error = self.fake._call("list_sheets")
+    if error:
+      return models.Error({"result": error})
+    sheets = sorted(self.fake.sheets.values(), key=lambda x: x["name"])
+    page_size = page_size or 100
+    page = page or 1
+    if not include_all:
+      total_pages = max(1, -(-len(sheets) // page_size))
+      sheets = sheets[(page - 1) * page_size:page * page_size]
+    else:
+      total_pages = 1
+    payload = {
+      "pageNumber": page,
+      "totalPages": total_pages,
+      "totalCount": len(self.fake.sheets),
+      "data": [{"id": x["id"], "name": x["name"], "version": x["version"]} for x in sheets],
+    }
+    return self.fake._respond(models.IndexResult(payload, "Sheet"), payload)
+
+  def get_sheet_version(self, sheet_id):
+    sheet, error = self._sheet("get_sheet_version", sheet_id)
+    if error:
+      return error
+    payload = {"version": sheet["version"]}
+    return self.fake._respond(models.Version(payload), payload)
+
+  def get_columns(self, sheet_id, include=None, page_size=100, page=1, include_all=False):
+    sheet, error = self._sheet("get_columns", sheet_id)
+    if error:
+      return error
+    payload = {"pageNumber": 1, "totalPages": 1, "data": sheet["columns"]}
+    return self.fake._respond(models.IndexResult(payload, "Column"), payload)
+
+  def get_sheet(self, sheet_id, include=None, exclude=None, row_ids=None, row_numbers=None, column_ids=None,
+                page_size=None, page=None, if_version_after=None, level=None, rows_modified_since=None, filter_id=None):
+    sheet, error = self._sheet("get_sheet", sheet_id)
+    if error:
+      return error
+    if if_version_after is not None and if_version_after >= sheet["version"]:
+      payload = {"version": sheet["version"]}
+      return self.fake._respond(models.Sheet(payload, self.fake), payload)
+    rows = sheet["rows"]
+    if rows_modified_since is not None:
+      since = datetime.fromisoformat(rows_modified_since)
+      rows = [x for x in rows if x["modified"] >= since]
+    if row_ids:
+      wanted = set(row_ids)
+      rows = [x for x in rows if x["id"] in wanted]
+    if page_size:
+      page = page or 1
+      rows = rows[(page - 1) * page_size:page * page_size]
+    column_ids = None if not column_ids else set(column_ids)
+    payload = {
+      "id": sheet["id"],
+      "name": sheet["name"],
+      "version": sheet["version"],
+      "totalRowCount": len(sheet["rows"]),
+      "columns": [x for x in sheet["columns"] if column_ids is None or x["id"] in column_ids],
+      "rows": [self._row(sheet, x, column_ids) for x in rows],
+    }
+    return self.fake._respond(models.Sheet(payload, self.fake), payload)
+
+  def add_rows(self, sheet_id, list_of_rows):
+    sheet, error = self._sheet("add_rows", sheet_id)
+    if error:
+      return error
+    added = [self.fake._append_row(sheet, self._cells(x)) for x in list_of_rows]
+    self.fake.Webhooks.notify(sheet_id, [{"objectType": "row", "eventType": "created", "id": x["id"]} for x in added])
+    return self._result(sheet, [self._row(sheet, x) for x in added], "Row")
+
+  def update_rows(self, sheet_id, list_of_rows):
+    sheet, error = self._sheet("update_rows", sheet_id)
+    if error:
+      return error
+    by_id = {x["id"]:x for x in sheet["rows"]}
+    if any(x.id not in by_id for x in list_of_rows):
+      return models.Error({"result": NOT_FOUND})
+    updated = []
+    for row in list_of_rows:
+      target = by_id[row.id]
+      for column_id, value in self._cells(row).items():
+        if value == "":
+          target["cells"].pop(column_id, None)
+        else:
+          target["cells"][column_id] = value
+      target["modified"] = datetime.now(timezone.utc)
+      updated.append(target)
+    self.fake.Webhooks.notify(sheet_id, [{"objectType": "row", "eventType": "updated", "id": x["id"]} for x in updated])
+    return self._result(sheet, [self._row(sheet, x) for x in updated], "Row")
+
+  def delete_rows(self, sheet_id, ids, ignore_rows_not_found=False):
+    sheet, error = self._sheet("delete_rows", sheet_id)
+    if error:
+      return error
+    deleted = set(ids)
+    sheet["rows"] = [x for x in sheet["rows"] if x["id"] not in deleted]
+    self.fake.Webhooks.notify(sheet_id, [{"objectType": "row", "eventType": "deleted", "id": x} for x in deleted])
+    return self._result(sheet, list(deleted), None)
+
+  def move_rows(self, sheet_id, copy_or_move_row_directive_obj, include=None, ignore_rows_not_found=None):
+    sheet, error = self._sheet("move_rows", sheet_id)
+    if error:
+      return error
+    directive = copy_or_move_row_directive_obj.to_dict()
+    destination = self.fake.sheets.get(directive["to"]["sheetId"])
+    if destination is None:
+      return models.Error({"result": NOT_FOUND})
+    # cells follow their column title, values of columns missing in the destination are lost
+    id_to_title = {x["id"]:x["title"] for x in sheet["columns"]}
+    title_to_id = {x["title"]:x["id"] for x in destination["columns"]}
+    moving = set(directive["rowIds"])
+    moved = [x for x in sheet["rows"] if x["id"] in moving]
+    sheet["rows"] = [x for x in sheet["rows"] if x["id"] not in moving]
+    for row in moved:
+      cells = {title_to_id[id_to_title[k]]:v for k, v in row["cells"].items() if id_to_title[k] in title_to_id}
+      destination["rows"].append(dict(row, cells=cells))
+    sheet["version"] += 1
+    destination["version"] += 1
+    self.fake.Webhooks.notify(sheet_id, [{"objectType": "row", "eventType": "deleted", "id": x["id"]} for x in moved])
+    self.fake.Webhooks.notify(destination["id"], [{"objectType": "row", "eventType": "created", "id": x["id"]} for x in moved])
+    payload = {"destinationSheetId": destination["id"], "rowMappings": [{"from": x["id"], "to": x["id"]} for x in moved]}
+    return self.fake._respond(models.CopyOrMoveRowResult(payload), payload)
+
+  def _sheet(self, name:str, sheet_id:int) -> tuple[dict[str, Any]|None, Any]:
+    error = self.fake._call(name)
+    if error is None and sheet_id not in self.fake.sheets:
+      error = NOT_FOUND
+    if error:
+      return None, models.Error({"result": error})
+    return self.fake.sheets[sheet_id], None
+
+  def _result(self, sheet:dict[str, Any], result:List[Any], result_type:str|None) -> Any:
+    with self.fake.lock:
+      sheet["version"] += 1
+      payload = {"message": "SUCCESS", "resultCode": 0, "version": sheet["version"], "result": result}
+    if result_type is None:
+      return self.fake._respond(models.Result({k:v for k, v in payload.items() if k != "result"}), payload)
+    return self.fake._respond(models.Result(payload, result_type), payload)
+
+  def _row(self, sheet:dict[str, Any], row:dict[str, Any], column_ids:set[int]|None=None) -> dict[str, Any]:
+    cells = []
+    for column in sheet["columns"]:
+      value = row["cells"].get(column["id"])
+      if value is not None and (column_ids is None or column["id"] in column_ids):
+        cells.append({"columnId": column["id"], "value": value, "displayValue": str(value)})
+    return {"id": row["id"], "cells": cells, "modifiedAt": row["modified"].isoformat()}
+
+  def _cells(self, row:Any) -> dict[int, Any]:
+    cells = {}
+    for cell in row.to_dict().get("cells", []):
+      if "objectValue" in cell:
+        cells[cell["columnId"]] = cell["objectValue"].get("value")
+      else:
+        cells[cell["columnId"]] = cell.get("value")
+    return cells
+
+class FakeFolders:
+  """ The Folders section of FakeSmartsheet """
+
+  def __init__(self, fake:FakeSmartsheet) -> None:
+    self.fake = fake
+
+  def create_sheet_in_folder(self, folder_id, sheet_obj):
+    error = self.fake._call("create_sheet_in_folder")
+    if error:
+      return models.Error({"result": error})
+    sheet_id = self.fake.create_sheet(sheet_obj.to_dict())
+    sheet = self.fake.sheets[sheet_id]
+    payload = {"message": "SUCCESS", "resultCode": 0, "result": {"id": sheet_id, "name": sheet["name"]}}
+    return self.fake._respond(models.Result(payload, "Sheet"), payload)
+
+class FakeWebhooks:
+  """ The Webhooks section of FakeSmartsheet, posts what Smartsheet would to the callback url of a webhook:
+  the challenge when it is enabled, and signed events right after every change of its sheet """
+
+  def __init__(self, fake:FakeSmartsheet) -> None:
+    self.fake = fake
+    self.webhooks:dict[int, dict[str, Any]] = {}
+
+  def list_webhooks(self, page_size=None, page=None, include_all=None):
+    error = self.fake._call("list_webhooks")
+    if error:
+      return models.Error({"result": error})
+    payload = {"pageNumber": 1, "totalPages": 1, "totalCount": len(self.webhooks), "data": list(self.webhooks.values())}
+    return self.fake._respond(models.IndexResult(payload, "Webhook"), payload)
+
+  def create_webhook(self, webhook_obj):
+    error = self.fake._call("create_webhook")
+    if error:
+      return models.Error({"result": error})
+    webhook = dict(webhook_obj.to_dict(), id=next(self.fake.ids), enabled=False, status="NEW_NOT_VERIFIED", sharedSecret=secrets.token_hex(16))
+    self.webhooks[webhook["id"]] = webhook
+    payload = {"message": "SUCCESS", "resultCode": 0, "result": webhook}
+    return self.fake._respond(models.Result(payload, "Webhook"), payload)
+
+  def update_webhook(self, webhook_id, webhook_obj):
+    error = self.fake._call("update_webhook")
+    webhook = self.webhooks.get(webhook_id)
+    if error or webhook is None:
+      return models.Error({"result": error or NOT_FOUND})
+    if webhook_obj.to_dict().get("enabled"):
+      # enabled only once the callback url answers the challenge
+      challenge = secrets.token_hex(8)
+      answer = self._post(webhook, {"challenge": challenge, "webhookId": webhook_id}, {"Smartsheet-Hook-Challenge": challenge})
+      verified = answer is not None and challenge in [answer[0].get("Smartsheet-Hook-Response"), answer[1].get("smartsheetHookResponse")]
+      webhook.update(enabled=verified, status="ENABLED" if verified else "DISABLED_VERIFICATION_FAILED")
+    else:
+      webhook.update(enabled=False, status="DISABLED_BY_OWNER")
+    payload = {"message": "SUCCESS", "resultCode": 0, "result": webhook}
+    return self.fake._respond(models.Result(payload, "Webhook"), payload)
+
+  def delete_webhook(self, webhook_id):
+    error = self.fake._call("delete_webhook")
+    if error or self.webhooks.pop(webhook_id, None) is None:
+      return models.Error({"result": error or NOT_FOUND})
+    payload = {"message": "SUCCESS", "resultCode": 0}
+    return self.fake._respond(models.Result(payload), payload)
+
+  def notify(self, sheet_id:int, events:List[dict[str, Any]]) -> None:
+    """ Post the events to the enabled webhooks of the sheet, a webhook whose callback fails is disabled """
+    for webhook in list(self.webhooks.values()):
+      if not webhook["enabled"] or webhook["scopeObjectId"] != sheet_id:
+        continue
+      body = {
+        "nonce": secrets.token_hex(8),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "webhookId": webhook["id"],
+        "scope": "sheet",
+        "scopeObjectId": sheet_id,
+        "events": [{"objectType": "sheet", "eventType": "updated", "id": sheet_id}] + events,
+      }
+      if self._post(webhook, body) is None:
+        webhook.update(enabled=False, status="DISABLED_CALLBACK_FAILED")
+
+  def _post(self, webhook:dict[str, Any], body:dict[str, Any], headers:dict[str, str]|None=None) -> tuple[Any, dict[str, Any]]|None:
+    """ Headers and json answer of the callback, None when it failed """
+    content = json.dumps(body).encode()
+    signature = hmac.new(webhook["sharedSecret"].encode(), content, hashlib.sha256).hexdigest()
+    headers = dict(headers or {}, **{"Content-Type": "application/json", "Smartsheet-Hmac-SHA256": signature})
+    try:
+      with request.urlopen(request.Request(webhook["callbackUrl"], content, headers), timeout=5) as response:
+        return response.headers, json.loads(response.read() or b"{}")
+    except (OSError, ValueError):
+      return None
@@ -0,0 +1,102 @@
+from typing import Any, Iterator, List
+from os import path
+from datetime import date
+import csv
+import json
+from . import Table, Todo, Util
+from .table import MAX_ROWS_PER_REQUEST
+
+class ImportReport:
+  """ Outcome of an import """
+
+  def __init__(self) -> None:
+    self.imported = 0
+    self.failed = 0
+    # (first record, last record, reason) of every rejected record or chunk
+    self.errors:List[tuple[int, int, str]] = []
+
+  def __str__(self) -> str:
+    lines = [f"Imported {self.imported} todos, {self.failed} failed"]
+    for first, last, reason in self.errors:
+      where = f"record {first}" if first == last else f"records {first}-{last}"
+      lines.append(f"  {where}: {reason}")
+    return "\n".join(lines)
+
+class Importer:
+  """ Bulk import of todos from csv or jsonl files """
+
+  @staticmethod
+  def import_file(table:Table, file_name:str, chunk_size:int=MAX_ROWS_PER_REQUEST) -> ImportReport:
+    """ Stream records from the file and add them chunk by chunk, as many chunks at once as the table has workers """
+    report = ImportReport()
+    window = 1 if table.executor is None else table.executor.workers
+    # (first record, last record, rows) of the chunks waiting to be sent
+    pending:List[tuple[int, int, List[dict[str, str]]]] = []
+    chunk:List[dict[str, str]] = []
+    first = 1
+    for number, record in enumerate(Importer.read_records(file_name), start=1):
+      try:
+        chunk.append(Importer.to_todo(table, record).to_row())
+      except ValueError as e:
+        report.failed += 1
+        report.errors.append((number, number, str(e)))
+      if len(chunk) == chunk_size:
+        pending.append((first, number, chunk))
+        chunk = []
+        first = number + 1
+        if len(pending) == window:
+          Importer._flush(table, pending, report)
+          pending = []
+    if len(chunk):
+      pending.append((first, number, chunk))
+    if len(pending):
+      Importer._flush(table, pending, report)
+    return report
+
+  @staticmethod
+  def read_records(file_name:str) -> Iterator[dict[str, Any]]:
+    """ Records from a .csv file with a header row, or one json object per line """
+    with open(file_name, newline="") as f:
+      if path.splitext(file_name)[1].lower() == ".csv":
+        yield from csv.DictReader(f)
+      else:
+        for line in f:
+          if line.strip() != "":
+            try:
+              yield json.loads(line)
+            except ValueError:
+              # reported by to_todo, keeps the rest of the file going
+              yield line.strip()
+
+  @staticmethod
+  def to_todo(table:Table, record:dict[str, Any]) -> Todo:
+    """ Accepts the keys of the create command, and completed_at as written by export """
+    if not isinstance(record, dict):
+      raise ValueError(f"not a todo: {record}")
+    task = record.get("task", None)
+    if task is None or task == "":
+      raise ValueError("missing task")
+    todo = Todo(table, task, Importer._date(record.get("due_date", None) or record.get("date", None), "due_date"), record.get("notes", None) or None)
+    todo.completed_at = Importer._date(record.get("completed_at", None), "completed_at")
+    status = record.get("status", None)
+    if status is not None and status != "":
+      todo.status = status
+    return todo
+
+  @staticmethod
+  def _date(value:Any, key:str) -> date|None:
+    if value is None or value == "":
+      return None
+    if not isinstance(value, str):
+      raise ValueError(f"{key} must look like 2023-12-12, not {value}")
+    return Util.parse_date(value)
+
+  @staticmethod
+  def _flush(table:Table, pending:List[tuple[int, int, List[dict[str, str]]]], report:ImportReport) -> None:
+    errors = table.insert_chunks([x[2] for x in pending])
+    for (first, last, chunk), error in zip(pending, errors):
+      if error is not None:
+        report.failed += len(chunk)
+        report.errors.append((first, last, error))
+      else:
+        report.imported += len(chunk)
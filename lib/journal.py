@@ -0,0 +1,298 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, List
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
+import fcntl
+import json
+import os
+from . import Util, Table
+from .table import MAX_ROWS_PER_REQUEST, MAX_ROW_IDS_PER_DELETE
+if TYPE_CHECKING:
+  from smartsheet.models.row import Row
+  from . import Database
+
+# writes this close together go out in one batch
+COALESCE_DELAY = 0.05
+# a failed write is sent again after this many seconds, doubled per attempt up to MAX_RETRY_DELAY
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+class Journal:
+  """ Write-behind queue: writes patch the loaded rows right away, are appended to an fsync'd file
+  and sent to Smartsheet in the background, they stay in the file until sent so they survive a restart """
+
+  def __init__(self, db:Database, file_name:str) -> None:
+    """ Raises OSError when another process writes behind through the same file """
+    self.db = db
+    self.file_name = file_name
+    # held for the life of the process, next to the journal since _compact replaces it
+    self.lock_file = open(f"{file_name}.lock", "a")
+    try:
+      fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      self.lock_file.close()
+      raise OSError(f"Another process writes behind through {file_name}")
+    self.lock = Lock()
+    # held while a round of writes is sent, see flush
+    self.flushing = Lock()
+    # seq -> entry not sent yet, in the order written
+    self.entries:dict[int, dict[str, Any]] = {}
+    # temporary id of a row added locally -> id the sheet gave it
+    self.ids:dict[int, int] = {}
+    # seq -> (attempts, monotonic time of the next one) of the entries whose last attempt failed
+    self.failures:dict[int, tuple[int, float]] = {}
+    # seq -> message of the last failed attempt
+    self.errors:dict[int, str] = {}
+    # entries in a request right now, a delete can no longer cancel their insert
+    self.sending:set[int] = set()
+    # (sheet id, temporary ids, rows added, version) sent but not yet applied to the loaded tables, see settle
+    self.settled:List[tuple[int, List[int], List[Row], int|None]] = []
+    self.seq = 0
+    self.event = Event()
+    self.stopped = False
+    self.thread = Thread(target=self._run, name="journal", daemon=True)
+    self._read()
+    self._compact()
+    self.file = open(file_name, "a")
+
+  def start(self) -> None:
+    self.thread.start()
+    self.event.set()
+
+  def stop(self) -> None:
+    """ Entries not sent yet stay in the file for the next run """
+    self.stopped = True
+    self.event.set()
+
+  def counts(self) -> tuple[int, int]:
+    """ Entries not sent yet, and how many of them failed their last attempt """
+    with self.lock:
+      return len(self.entries), len(self.failures)
+
+  def insert(self, table:Table, rows:List[Row]) -> List[Row]:
+    """ Queue new rows, they get negative temporary ids until the sheet has them """
+    with self.lock:
+      entries = []
+      for row in rows:
+        self.seq += 1
+        row.id = -self.seq
+        entries.append({"seq": self.seq, "sheet": table.id, "op": "insert", "row": row.to_dict()})
+      self._append(entries)
+    self.event.set()
+    return rows
+
+  def update(self, table:Table, rows:List[Row]) -> List[Row]:
+    """ Queue cell changes, rows hold the changed cells only """
+    with self.lock:
+      self._append([self._entry(table.id, "update", row.to_dict()) for row in rows])
+    self.event.set()
+    return rows
+
+  def delete(self, table:Table, ids:List[int]) -> None:
+    """ Queue deletes, a row whose insert was not sent yet is simply never sent """
+    with self.lock:
+      entries = []
+      for row_id in ids:
+        if row_id < 0 and row_id not in self.ids and -row_id in self.entries and -row_id not in self.sending:
+          cancelled = [x["seq"] for x in self.entries.values() if x["sheet"] == table.id and Journal._row_id(x) == row_id]
+          entries.append({"done": cancelled})
+          self._forget(cancelled)
+        else:
+          entries.append(self._entry(table.id, "delete", {"id": row_id}))
+      self._append(entries)
+    self.event.set()
+
+  def holds(self, sheet_id:int) -> bool:
+    """ Whether writes to the sheet are not sent yet, or not yet applied to its loaded table """
+    with self.lock:
+      return any(x["sheet"] == sheet_id for x in self.entries.values()) or any(x[0] == sheet_id for x in self.settled)
+
+  def replay(self, table:Table) -> None:
+    """ Patch a table just downloaded with the entries of its sheet not sent yet """
+    with self.lock:
+      entries = [x for x in self.entries.values() if x["sheet"] == table.id]
+      ids = dict(self.ids)
+    for entry in entries:
+      row_id = ids.get(Journal._row_id(entry), Journal._row_id(entry))
+      if entry["op"] == "delete":
+        table.apply_local([], [row_id])
+      elif entry["op"] == "update" or row_id < 0:
+        row = self.db.smart.models.Row(entry["row"])
+        row.id = row_id
+        table.apply_local([row], [])
+
+  def settle(self) -> None:
+    """ Apply what the sheet answered to the loaded tables, from the thread reading them """
+    with self.lock:
+      settled, self.settled = self.settled, []
+    for sheet_id, temporary, rows, version in settled:
+      table = self.db.tables.get(sheet_id)
+      if table is not None:
+        table.resolve_rows(temporary, rows, version)
+        if len(temporary):
+          # changes made to the rows before the sheet had them
+          self.replay(table)
+
+  def flush(self) -> None:
+    """ Send the entries due, consecutive ones of the same kind to the same sheet in one batch,
+    a row with an earlier write still waiting keeps its later writes waiting too """
+    with self.flushing:
+      now = monotonic()
+      with self.lock:
+        entries = list(self.entries.values())
+      held:set[tuple[int, int]] = set()
+      batch:List[dict[str, Any]] = []
+      for entry in entries:
+        if len(batch) and (batch[0]["sheet"], batch[0]["op"]) != (entry["sheet"], entry["op"]):
+          held |= self._send(batch)
+          batch = []
+        key = (entry["sheet"], Journal._row_id(entry))
+        with self.lock:
+          waiting = entry["seq"] not in self.entries or self.failures.get(entry["seq"], (0, 0))[1] > now
+          unknown = entry["op"] != "insert" and key[1] < 0 and key[1] not in self.ids
+          if waiting or unknown or key in held:
+            held.add(key)
+            continue
+          self.sending.add(entry["seq"])
+        batch.append(entry)
+      if len(batch):
+        self._send(batch)
+
+  def _send(self, batch:List[dict[str, Any]]) -> set[tuple[int, int]]:
+    """ Send a batch, returns the rows of the entries that failed """
+    sheet_id = batch[0]["sheet"]
+    op = batch[0]["op"]
+    models = self.db.smart.models
+    with self.lock:
+      ids = dict(self.ids)
+    # row id -> entries of the batch writing it, temporary ids swapped for the ones the sheet gave
+    by_row:dict[int, List[dict[str, Any]]] = {}
+    for entry in batch:
+      by_row.setdefault(ids.get(Journal._row_id(entry), Journal._row_id(entry)), []).append(entry)
+    if op == "insert":
+      chunks = [(x, [models.Row({"cells": e["row"]["cells"]}) for e in x]) for x in Util.chunks(batch, MAX_ROWS_PER_REQUEST)]
+      request = lambda rows: self.db.smart.Sheets.add_rows(sheet_id, rows)
+    elif op == "update":
+      # later changes of a cell win
+      rows = [models.Row({"id": x, "cells": list({c["columnId"]:c for e in entries for c in e["row"]["cells"]}.values())}) for x, entries in by_row.items()]
+      chunks = [([e for x in chunk for e in by_row[x.id]], chunk) for chunk in Util.chunks(rows, MAX_ROWS_PER_REQUEST)]
+      request = lambda rows: self.db.smart.Sheets.update_rows(sheet_id, rows)
+    else:
+      chunks = [([e for x in chunk for e in by_row[x]], chunk) for chunk in Util.chunks(list(by_row), MAX_ROW_IDS_PER_DELETE)]
+      request = lambda ids: self.db.smart.Sheets.delete_rows(sheet_id, ids, ignore_rows_not_found=True)
+    failed:set[tuple[int, int]] = set()
+    for (entries, _), response in zip(chunks, self.db.executor.map(lambda x: self._request(request, x[1]), chunks)):
+      if isinstance(response, str):
+        self._failed(entries, response)
+        failed |= {(sheet_id, Journal._row_id(x)) for x in entries}
+      else:
+        self._sent(sheet_id, entries, response)
+    return failed
+
+  def _request(self, request:Any, payload:Any) -> Any:
+    """ The response, or the message of the error """
+    try:
+      response = request(payload)
+    except Exception as e:
+      return str(e)
+    if isinstance(response, self.db.smart.models.Error):
+      return response.result.message
+    return response
+
+  def _sent(self, sheet_id:int, entries:List[dict[str, Any]], response:Any) -> None:
+    seqs = [x["seq"] for x in entries]
+    with self.lock:
+      record:dict[str, Any] = {"done": seqs}
+      temporary = []
+      rows = []
+      if entries[0]["op"] == "insert":
+        temporary = [Journal._row_id(x) for x in entries]
+        rows = list(response.result)
+        record["ids"] = {str(k):v.id for k, v in zip(temporary, rows)}
+        self.ids.update(zip(temporary, [x.id for x in rows]))
+      self._forget(seqs)
+      self._append([record])
+      self.settled.append((sheet_id, temporary, rows, response.version))
+
+  def _failed(self, entries:List[dict[str, Any]], message:str) -> None:
+    with self.lock:
+      for entry in entries:
+        attempts = self.failures.get(entry["seq"], (0, 0))[0] + 1
+        self.failures[entry["seq"]] = (attempts, monotonic() + min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (attempts - 1)))
+        self.errors[entry["seq"]] = message
+        self.sending.discard(entry["seq"])
+
+  def _forget(self, seqs:List[int]) -> None:
+    for seq in seqs:
+      self.entries.pop(seq, None)
+      self.failures.pop(seq, None)
+      self.errors.pop(seq, None)
+      self.sending.discard(seq)
+
+  def _entry(self, sheet_id:int, op:str, row:dict[str, Any]) -> dict[str, Any]:
+    self.seq += 1
+    return {"seq": self.seq, "sheet": sheet_id, "op": op, "row": row}
+
+  def _append(self, records:List[dict[str, Any]]) -> None:
+    """ Write records to the file and make sure they are on disk, emptied once nothing is left to send """
+    for record in records:
+      if "seq" in record:
+        self.entries[record["seq"]] = record
+    if len(self.entries) == 0:
+      self.file.truncate(0)
+      self.ids.clear()
+    elif len(records):
+      self.file.write("".join(json.dumps(x) + "\n" for x in records))
+    self.file.flush()
+    os.fsync(self.file.fileno())
+
+  def _read(self) -> None:
+    """ Entries left by an earlier run, a line cut short by a crash is skipped """
+    try:
+      with open(self.file_name) as f:
+        lines = f.readlines()
+    except OSError:
+      return
+    for line in lines:
+      try:
+        record = json.loads(line)
+      except ValueError:
+        continue
+      if "seq" in record:
+        self.entries[record["seq"]] = record
+        self.seq = max(self.seq, record["seq"])
+      else:
+        self.ids.update({int(k):v for k, v in record.get("ids", {}).items()})
+        for seq in record["done"]:
+          self.entries.pop(seq, None)
+
+  def _compact(self) -> None:
+    """ Rewrite the file with only the entries left, drops a line cut short that later lines would be appended to """
+    records = list(self.entries.values())
+    if len(self.ids) and len(records):
+      records.append({"done": [], "ids": {str(k):v for k, v in self.ids.items()}})
+    with open(f"{self.file_name}.tmp", "w") as f:
+      f.write("".join(json.dumps(x) + "\n" for x in records))
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(f"{self.file_name}.tmp", self.file_name)
+
+  def _run(self) -> None:
+    while not self.stopped:
+      with self.lock:
+        retries = [x[1] for x in self.failures.values()]
+      self.event.wait(None if len(retries) == 0 else max(0, min(retries) - monotonic()))
+      self.event.clear()
+      if self.stopped:
+        return
+      # let the writes of the next few commands join the batch
+      sleep(COALESCE_DELAY)
+      try:
+        self.flush()
+      except Exception:
+        # entries stay in the file, the next round sends them
+        pass
+
+  @staticmethod
+  def _row_id(entry:dict[str, Any]) -> int:
+    return entry["row"]["id"]
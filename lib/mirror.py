@@ -0,0 +1,112 @@
+from typing import List
+from datetime import date
+import json
+import sqlite3
+from . import Table, Todo, TodoFilterType, Util
+from .todo import PRINT_TABLE_HEADER, TodoStatusType
+
+SCHEMA = [
+  '''CREATE TABLE IF NOT EXISTS todos (
+    row_id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    id TEXT,
+    task TEXT,
+    due_date TEXT,
+    completed_at TEXT,
+    notes TEXT,
+    status TEXT
+  )''',
+  "CREATE INDEX IF NOT EXISTS todos_id ON todos (id)",
+  "CREATE INDEX IF NOT EXISTS todos_due_date ON todos (due_date)",
+  "CREATE INDEX IF NOT EXISTS todos_status ON todos (status)",
+  "CREATE INDEX IF NOT EXISTS todos_completed_at ON todos (completed_at)",
+  "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+]
+
+COLUMNS = "id, task, status, due_date, completed_at"
+
+class Mirror:
+  """ Local sqlite copy of the todo sheet, serves reads without calling Smartsheet """
+
+  def __init__(self, file_name:str) -> None:
+    self.connection = sqlite3.connect(file_name, check_same_thread=False)
+    for statement in SCHEMA:
+      self.connection.execute(statement)
+    self.connection.commit()
+
+  def sync(self, table:Table|List[Table]) -> None:
+    """ Replace the mirror with the loaded table, or all shards of the list """
+    tables = Todo._tables(table)
+    with self.connection:
+      self.connection.execute("DELETE FROM todos")
+      self._insert(Todo._rows(tables), 0)
+      self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (Mirror._version(tables),))
+
+  def is_current(self, table:Table|List[Table]) -> bool:
+    """ Whether the mirror was synced from the loaded table, or all shards of the list, as they are now """
+    return self.version() == Mirror._version(Todo._tables(table))
+
+  def upsert(self, todos:List[Todo]) -> None:
+    """ Write through changed or new todos """
+    position = self.connection.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM todos").fetchone()[0]
+    with self.connection:
+      self._insert(todos, position)
+
+  def delete(self, row_ids:List[int]) -> None:
+    with self.connection:
+      self.connection.executemany("DELETE FROM todos WHERE row_id = ?", [(x,) for x in row_ids])
+
+  def version(self) -> str|None:
+    """ Sheets and versions the mirror was synced from """
+    found = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    return None if found is None else found[0]
+
+  def find_by_id(self, id:str) -> Todo|None:
+    found = self.connection.execute(f"SELECT {COLUMNS}, notes FROM todos WHERE id = ?", (id,)).fetchone()
+    if found is None:
+      return None
+    todo = Todo(None, found[1], Mirror._date(found[3]), found[5])
+    todo.id = found[0]
+    todo.status = found[2]
+    todo.completed_at = Mirror._date(found[4])
+    return todo
+
+  def create_print_table(self, todo_filter:TodoFilterType=TodoFilterType.UNFINISHED, status:str|None=None, after:date|None=None, before:date|None=None, count:int|None=None) -> List[List[str]]:
+    """ Same output as Todo.create_print_table """
+    after, before = Todo.due_bounds(todo_filter, after, before)
+    conditions, params = [], []
+    if todo_filter != TodoFilterType.ALL:
+      conditions.append("completed_at IS NULL")
+    if status is not None:
+      conditions.append("LOWER(COALESCE(status, ?)) = LOWER(?)")
+      params += [TodoStatusType.BACKLOG.value, status]
+    if after is not None:
+      conditions.append("due_date > ?")
+      params.append(Util.date_as_str(after))
+    if before is not None:
+      conditions.append("due_date < ?")
+      params.append(Util.date_as_str(before))
+    where = "" if len(conditions) == 0 else "WHERE " + " AND ".join(conditions)
+    # sqlite reads a negative limit as none
+    rows = self.connection.execute(f"SELECT {COLUMNS} FROM todos {where} ORDER BY due_date IS NULL, due_date, position LIMIT ?", params + [-1 if count is None else count])
+    todos = [list(map(str, row)) for row in rows]
+    todos.insert(0, list(PRINT_TABLE_HEADER))
+    return todos
+
+  def _insert(self, todos:List[Todo], position:int) -> None:
+    self.connection.executemany(
+      "INSERT OR REPLACE INTO todos VALUES (?, COALESCE((SELECT position FROM todos WHERE row_id = ?), ?), ?, ?, ?, ?, ?, ?)",
+      [(x.row.id, x.row.id, position + i, x.id, x.task, Mirror._date_str(x.due_date), Mirror._date_str(x.completed_at), x.notes, x.status) for i, x in enumerate(todos)])
+
+  @staticmethod
+  def _version(tables:List[Table]) -> str:
+    # a mirror of other sheets or shards, or of the same ones at other versions, never matches
+    return json.dumps(sorted([x.id, x.version] for x in tables))
+
+  @staticmethod
+  def _date(value:str|None):
+    return None if value is None else Util.parse_date(value)
+
+  @staticmethod
+  def _date_str(value) -> str|None:
+    return None if value is None else Util.date_as_str(value)
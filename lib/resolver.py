@@ -0,0 +1,87 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterator
+from os import path
+from time import monotonic
+from threading import Lock
+import json
+if TYPE_CHECKING:
+  from smartsheet import Smartsheet
+  from smartsheet.models import Sheet
+
+# seconds a name not found among the sheets is answered with None before paging through them again
+MISSING_TTL = 30
+
+class SheetResolver:
+  """ Resolves sheet names to ids, remembered on disk between runs """
+
+  def __init__(self, smart:Smartsheet, cache_path:str|None=None, page_size:int=100) -> None:
+    self.smart = smart
+    self.cache_path = cache_path
+    self.page_size = page_size
+    self.ids:dict[str, int] = self._load()
+    # name -> monotonic time it was not found, see MISSING_TTL
+    self.missing:dict[str, float] = {}
+    # resolved from several threads, one write of the cache file at a time
+    self.lock = Lock()
+    # why the last listing of the sheets stopped early, a name is only known missing without one
+    self.error = None
+
+  def resolve(self, name:str) -> int|None:
+    """ Cached id, otherwise page through the sheets until the first match """
+    if name in self.ids:
+      return self.ids[name]
+    if monotonic() - self.missing.get(name, float("-inf")) < MISSING_TTL:
+      return None
+    for sheet in self.iter_sheets():
+      if sheet.name == name:
+        self.remember(name, sheet.id)
+        return sheet.id
+    if self.error is None:
+      self.missing[name] = monotonic()
+    return None
+
+  def remember(self, name:str, sheet_id:int) -> None:
+    with self.lock:
+      self.missing.pop(name, None)
+      self.ids[name] = sheet_id
+      self._save()
+
+  def forget(self, name:str) -> bool:
+    """ Drop a cached id, returns whether there was one """
+    with self.lock:
+      if self.ids.pop(name, None) is None:
+        return False
+      self._save()
+      return True
+
+  def iter_sheets(self) -> Iterator[Sheet]:
+    """ Lazily page through all sheets """
+    page = 1
+    self.error = None
+    while True:
+      response = self.smart.Sheets.list_sheets(page_size=self.page_size, page=page)
+      if isinstance(response, self.smart.models.Error):
+        self.error = response
+        return
+      yield from response.data
+      if response.total_pages is None or page >= response.total_pages:
+        return
+      page += 1
+
+  def _load(self) -> dict[str, int]:
+    if self.cache_path is None or not path.exists(self.cache_path):
+      return {}
+    try:
+      with open(self.cache_path) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return {}
+
+  def _save(self) -> None:
+    if self.cache_path is None:
+      return
+    try:
+      with open(self.cache_path, "w") as f:
+        json.dump(self.ids, f)
+    except OSError:
+      pass
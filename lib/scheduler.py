@@ -0,0 +1,158 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Callable
+from threading import Lock
+from time import monotonic, perf_counter, sleep
+import random
+from .stats import Stats
+if TYPE_CHECKING:
+  from smartsheet import Smartsheet
+
+# the API allows 300 requests per minute per access token
+REQUESTS_PER_MINUTE = 300
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+RATE_LIMITED = 429
+# not safe to send twice, only retried when the API rejected them with 429
+NON_IDEMPOTENT = ["add_rows", "copy_rows", "move_rows", "delete_rows", "create_sheet_in_folder"]
+
+class TokenBucket:
+  """ Blocking token bucket, refilled continuously """
+
+  def __init__(self, rate:float, capacity:float) -> None:
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = monotonic()
+    self.lock = Lock()
+
+  def acquire(self) -> float:
+    """ Take a token, returns the seconds spent waiting for it """
+    waited = 0.0
+    while True:
+      with self.lock:
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return waited
+        delay = (1 - self.tokens) / self.rate
+      sleep(delay)
+      waited += delay
+
+class RequestScheduler:
+  """ Rate limits Smartsheet requests and retries the ones that failed transiently """
+
+  def __init__(self, requests_per_minute:float=REQUESTS_PER_MINUTE, max_retries:int=5, base_delay:float=1.0, max_delay:float=30.0) -> None:
+    self.bucket = TokenBucket(requests_per_minute / 60, max(1, requests_per_minute / 10))
+    self.max_retries = max_retries
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.lock = Lock()
+    self.queue_depth = 0
+    self.max_queue_depth = 0
+    self.requests = 0
+    self.retries = 0
+    self.wait_time = 0.0
+    self.max_wait_time = 0.0
+
+  def call(self, name:str, func:Callable, *args, **kwargs) -> Any:
+    # loaded by the client already, kept out of the import of this module
+    from smartsheet.exceptions import HttpError, UnexpectedRequestError
+    idempotent = name not in NON_IDEMPOTENT
+    attempt = 0
+    while True:
+      self._wait()
+      start = perf_counter()
+      try:
+        result = func(*args, **kwargs)
+      except (HttpError, UnexpectedRequestError):
+        Stats.record_call(name, perf_counter() - start, 0)
+        if not idempotent or attempt >= self.max_retries:
+          raise
+      else:
+        Stats.record_call(name, perf_counter() - start, Stats.response_size(result))
+        status_code = RequestScheduler._status_code(result)
+        if status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+          return result
+        if not idempotent and status_code != RATE_LIMITED:
+          return result
+      attempt += 1
+      with self.lock:
+        self.retries += 1
+      sleep(self._backoff(attempt))
+
+  def metrics(self) -> dict[str, float]:
+    with self.lock:
+      return {
+        "requests": self.requests,
+        "retries": self.retries,
+        "queue_depth": self.queue_depth,
+        "max_queue_depth": self.max_queue_depth,
+        "wait_time": self.wait_time,
+        "max_wait_time": self.max_wait_time,
+      }
+
+  def _wait(self) -> None:
+    with self.lock:
+      self.queue_depth += 1
+      self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+    waited = self.bucket.acquire()
+    with self.lock:
+      self.queue_depth -= 1
+      self.requests += 1
+      self.wait_time += waited
+      self.max_wait_time = max(self.max_wait_time, waited)
+
+  def _backoff(self, attempt:int) -> float:
+    """ Full jitter exponential backoff """
+    return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+  @staticmethod
+  def _status_code(result:Any) -> int|None:
+    from smartsheet.models import Error
+    return result.result.status_code if isinstance(result, Error) else None
+
+class LazySmartsheet:
+  """ Imports the SDK and builds the client on first use, keeps both off the startup path """
+
+  def __init__(self, **kwargs) -> None:
+    self.kwargs = kwargs
+    self.client = None
+    self.lock = Lock()
+
+  def __getattr__(self, name:str) -> Any:
+    return getattr(self._client(), name)
+
+  def _client(self) -> Smartsheet:
+    with self.lock:
+      if self.client is None:
+        from smartsheet import Smartsheet
+        self.client = Smartsheet(**self.kwargs)
+      return self.client
+
+class ScheduledSmartsheet:
+  """ Smartsheet client whose Sheets, Folders and Webhooks calls go through a RequestScheduler """
+
+  def __init__(self, smart:Smartsheet, scheduler:RequestScheduler) -> None:
+    self.smart = smart
+    self.scheduler = scheduler
+    self.Sheets = ScheduledSection(smart, "Sheets", scheduler)
+    self.Folders = ScheduledSection(smart, "Folders", scheduler)
+    self.Webhooks = ScheduledSection(smart, "Webhooks", scheduler)
+
+  def __getattr__(self, name:str) -> Any:
+    return getattr(self.smart, name)
+
+class ScheduledSection:
+  """ Wraps the methods of one SDK section such as Sheets, looked up on the client when first called """
+
+  def __init__(self, smart:Smartsheet, name:str, scheduler:RequestScheduler) -> None:
+    self.smart = smart
+    self.name = name
+    self.scheduler = scheduler
+
+  def __getattr__(self, name:str) -> Any:
+    func = getattr(getattr(self.smart, self.name), name)
+    if not callable(func):
+      return func
+    return lambda *args, **kwargs: self.scheduler.call(name, func, *args, **kwargs)
@@ -0,0 +1,165 @@
+from __future__ import annotations
+from typing import List
+from bisect import bisect_left, insort
+from threading import Lock
+from math import log, sqrt
+import json
+import os
+import re
+
+TOKEN = re.compile(r"\w+")
+# positions of the next field start this far on, so a phrase never spans two fields
+FIELD_GAP = 1_000_000
+
+class SearchIndex:
+  """ Inverted index over text columns of a table: token -> row id -> positions of the token in the row """
+
+  def __init__(self, fields:dict[str, float]) -> None:
+    """ fields are the column titles indexed and the weight of a match in each """
+    self.fields = fields
+    self.weights = list(fields.values())
+    self.postings:dict[str, dict[int, List[int]]] = {}
+    # every token indexed, sorted for prefix lookups
+    self.tokens:List[str] = []
+    # row id -> number of tokens in the row
+    self.lengths:dict[int, int] = {}
+    # sheet version the index was last saved at, see Table.text_index
+    self.saved_version:int|None = None
+    # saves run on a worker while the rows may change
+    self.lock = Lock()
+
+  def add(self, row_id:int, texts:List[str|None]) -> None:
+    """ texts of the row, one per field """
+    positions:dict[str, List[int]] = {}
+    length = 0
+    for i, text in enumerate(texts):
+      tokens = SearchIndex.tokenize(text)
+      length += len(tokens)
+      for position, token in enumerate(tokens, i * FIELD_GAP):
+        positions.setdefault(token, []).append(position)
+    with self.lock:
+      for token, found in positions.items():
+        posting = self.postings.get(token)
+        if posting is None:
+          posting = self.postings[token] = {}
+          insort(self.tokens, token)
+        posting[row_id] = found
+      self.lengths[row_id] = length
+
+  def remove(self, row_id:int, texts:List[str|None]) -> None:
+    """ texts as they were added """
+    with self.lock:
+      for token in {x for text in texts for x in SearchIndex.tokenize(text)}:
+        posting = self.postings.get(token)
+        if posting is None or posting.pop(row_id, None) is None or len(posting):
+          continue
+        del self.postings[token]
+        del self.tokens[bisect_left(self.tokens, token)]
+      self.lengths.pop(row_id, None)
+
+  def search(self, query:str) -> List[tuple[int, float]]:
+    """ Row ids holding every term of the query, best match first.
+    "quoted words" must follow each other, a term ending with * matches any token it starts """
+    with self.lock:
+      scores:dict[int, float]|None = None
+      for term in SearchIndex.parse(query):
+        matches = self._term(term)
+        if scores is None:
+          scores = matches
+        else:
+          scores = {x:scores[x] + matches[x] for x in scores if x in matches}
+        if len(scores) == 0:
+          return []
+      if scores is None:
+        return []
+      # long notes should not outrank a short task holding the same words
+      ranked = [(x, score / sqrt(1 + self.lengths.get(x, 0))) for x, score in scores.items()]
+      return sorted(ranked, key=lambda x: -x[1])
+
+  def save(self, file_name:str, version:int) -> None:
+    """ Written next to the sheet cache, replaced atomically """
+    with self.lock:
+      data = json.dumps({"version": version, "fields": self.fields, "postings": self.postings, "lengths": self.lengths})
+    with open(f"{file_name}.tmp", "w") as f:
+      f.write(data)
+    os.replace(f"{file_name}.tmp", file_name)
+    self.saved_version = version
+
+  @staticmethod
+  def load(file_name:str, fields:dict[str, float], version:int) -> SearchIndex|None:
+    """ The saved index, None when missing or saved for other fields or another version of the sheet """
+    try:
+      with open(file_name) as f:
+        data = json.load(f)
+    except (OSError, ValueError):
+      return None
+    if data.get("version") != version or data.get("fields") != fields:
+      return None
+    index = SearchIndex(fields)
+    index.postings = {token:{int(k):v for k, v in posting.items()} for token, posting in data["postings"].items()}
+    index.tokens = sorted(index.postings)
+    index.lengths = {int(k):v for k, v in data["lengths"].items()}
+    index.saved_version = version
+    return index
+
+  @staticmethod
+  def tokenize(text:str|None) -> List[str]:
+    if text is None:
+      return []
+    # notes keep their line breaks as a literal \n
+    return TOKEN.findall(str(text).replace(r"\n", " ").lower())
+
+  @staticmethod
+  def parse(query:str) -> List[List[str]]:
+    """ Terms of the query, a phrase being several tokens """
+    terms = []
+    for i, part in enumerate(query.split('"')):
+      if i % 2:
+        phrase = SearchIndex.tokenize(part)
+        if len(phrase):
+          terms.append(phrase)
+      else:
+        terms += [[x.lower()] for x in part.split() if len(SearchIndex.tokenize(x))]
+    return terms
+
+  def _term(self, term:List[str]) -> dict[int, float]:
+    """ Score of every row holding the term """
+    if len(term) == 1 and term[0].endswith("*"):
+      prefix = SearchIndex.tokenize(term[0])
+      postings = [self.postings[x] for x in self._prefixed(prefix[0])] if len(prefix) else []
+    elif len(term) == 1:
+      token = SearchIndex.tokenize(term[0])
+      postings = [self.postings.get(token[0], {})] if len(token) == 1 else [self._phrase(token)]
+    else:
+      postings = [self._phrase(term)]
+    scores:dict[int, float] = {}
+    for posting in postings:
+      idf = log(1 + len(self.lengths) / max(1, len(posting)))
+      for row_id, positions in posting.items():
+        scores[row_id] = scores.get(row_id, 0) + idf * sum(self._weight(x) for x in positions)
+    return scores
+
+  def _prefixed(self, prefix:str) -> List[str]:
+    tokens = []
+    i = bisect_left(self.tokens, prefix)
+    while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+      tokens.append(self.tokens[i])
+      i += 1
+    return tokens
+
+  def _phrase(self, tokens:List[str]) -> dict[int, List[int]]:
+    """ Posting of the phrase, positions of its first token """
+    postings = [self.postings.get(x, {}) for x in tokens]
+    rarest = min(postings, key=len)
+    found = {}
+    for row_id in rarest:
+      if not all(row_id in x for x in postings):
+        continue
+      later = [set(x[row_id]) for x in postings[1:]]
+      starts = [p for p in postings[0][row_id] if all(p + i + 1 in x for i, x in enumerate(later))]
+      if len(starts):
+        found[row_id] = starts
+    return found
+
+  def _weight(self, position:int) -> float:
+    return self.weights[min(position // FIELD_GAP, len(self.weights) - 1)]
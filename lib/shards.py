@@ -0,0 +1,60 @@
+from typing import List
+from concurrent.futures import Future
+from datetime import date
+from . import Database, Table, Todo
+
+class Shards:
+  """ One logical todo list spread over a sheet per shard key, such as a year or a team """
+
+  def __init__(self, db:Database, table_name:str, keys:List[str]|None=None) -> None:
+    """ Without keys the list is the single sheet table_name """
+    self.db = db
+    self.table_name = table_name
+    self.keys = keys or []
+
+  def names(self) -> List[str]:
+    if len(self.keys) == 0:
+      return [self.table_name]
+    return [self.name(x) for x in self.keys]
+
+  def name(self, key:str) -> str:
+    return f"{self.table_name}_{key}"
+
+  @staticmethod
+  def prefix(key:str|None) -> str:
+    """ Auto number prefix of a shard, keeps ids unique across shards """
+    return "" if key is None else f"{key}-"
+
+  def tables(self, columns:List[str]|None=None, fresh:bool=False) -> List[Table]:
+    """ Every shard that exists, fetched concurrently """
+    return [x for x in self.db.find_tables(self.names(), columns, fresh) if x is not None]
+
+  def prefetch(self, columns:List[str]|None=None) -> List[Future]:
+    """ Start loading every shard not cached yet in the background, the next command checks the version of the others """
+    return [self.db.find_table_async(x, columns) for x in self.names() if not self.db.is_cached(x, columns)]
+
+  def table_for_new(self, key:str|None=None, due_date:date|None=None, columns:List[str]|None=None) -> Table|None:
+    """ Shard a new todo goes to: the given key, else the year of its due date, else the last shard """
+    if len(self.keys) == 0:
+      return self.db.find_table(self.table_name, columns)
+    if key is None and due_date is not None and str(due_date.year) in self.keys:
+      key = str(due_date.year)
+    if key is None:
+      key = self.keys[-1]
+    if key not in self.keys:
+      return None
+    return self.db.find_table(self.name(key), columns)
+
+  def create_missing(self, folder_id:str) -> List[str]:
+    """ Create the shards that do not exist in the folder, returns their names, Database.error tells why one was not """
+    created = []
+    keys:List[str|None] = self.keys or [None]
+    for key, name in zip(keys, self.names()):
+      if self.db.create_missing(name):
+        new_sheet = Todo.create_table(self.db.smart, name, folder_id, prefix=Shards.prefix(key))
+        if isinstance(new_sheet, self.db.smart.models.Error):
+          self.db.error = new_sheet
+          continue
+        self.db.resolver.remember(name, new_sheet.id)
+        created.append(name)
+    return created
@@ -0,0 +1,49 @@
+from typing import List
+from os import replace
+import json
+from . import Table, Todo, Util
+
+class Snapshot:
+  """ Todos as last loaded, kept on disk so the first command can render while the sheet loads """
+
+  def __init__(self, file_name:str|None) -> None:
+    self.file_name = file_name
+    # sheet versions of the saved todos, saves nothing new while they stay the same
+    self.versions:List[List[int]]|None = None
+
+  def load(self) -> List[Todo]|None:
+    if self.file_name is None:
+      return None
+    try:
+      with open(self.file_name) as f:
+        data = json.load(f)
+    except (OSError, ValueError):
+      return None
+    self.versions = data["versions"]
+    return [Snapshot._todo(*x) for x in data["todos"]]
+
+  def save(self, tables:List[Table]) -> None:
+    versions = [[x.id, x.version] for x in tables]
+    if self.file_name is None or versions == self.versions:
+      return
+    todos = [[x.id, x.task, x.status, Snapshot._date_str(x.due_date), Snapshot._date_str(x.completed_at)] for x in Todo._rows(tables)]
+    temp_name = f"{self.file_name}.tmp"
+    try:
+      with open(temp_name, "w") as f:
+        json.dump({"versions": versions, "todos": todos}, f)
+      replace(temp_name, self.file_name)
+      self.versions = versions
+    except OSError:
+      pass
+
+  @staticmethod
+  def _todo(id:str, task:str, status:str, due_date:str|None, completed_at:str|None) -> Todo:
+    todo = Todo(None, task, None if due_date is None else Util.parse_date(due_date))
+    todo.id = id
+    todo.status = status
+    todo.completed_at = None if completed_at is None else Util.parse_date(completed_at)
+    return todo
+
+  @staticmethod
+  def _date_str(value) -> str|None:
+    return None if value is None else Util.date_as_str(value)
@@ -0,0 +1,187 @@
+from typing import Any, Iterator, List
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from os import path, replace
+import json
+
+# upper bounds in milliseconds of the command latency histogram buckets
+LATENCY_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+# label of the api calls made outside of a command, by the refresher, prefetches, webhooks or the journal
+BACKGROUND = "background"
+
+class Stats:
+  """ Process wide counters and timings of API calls, local phases and commands """
+  lock = Lock()
+  calls:dict[str, list[float]] = {}
+  phases:dict[str, list[float]] = {}
+  commands:dict[str, dict[str, Any]] = {}
+  # api calls of the running command, carried to the executor threads working for it, None outside of commands
+  command_calls:ContextVar[list[int]|None] = ContextVar("command_calls", default=None)
+  background_calls = 0
+
+  @staticmethod
+  def record_call(name:str, seconds:float, size:int) -> None:
+    """ Count an SDK call, size is the number of bytes returned """
+    with Stats.lock:
+      entry = Stats.calls.setdefault(name, [0, 0.0, 0])
+      entry[0] += 1
+      entry[1] += seconds
+      entry[2] += size
+      counter = Stats.command_calls.get()
+      if counter is None:
+        Stats.background_calls += 1
+      else:
+        counter[0] += 1
+
+  @staticmethod
+  def response_size(result:Any) -> int:
+    response = getattr(result, "request_response", None)
+    content = getattr(response, "content", None)
+    return 0 if content is None else len(content)
+
+  @staticmethod
+  @contextmanager
+  def phase(name:str) -> Iterator[None]:
+    """ Time a local phase such as mapping rows or rendering """
+    start = perf_counter()
+    try:
+      yield
+    finally:
+      seconds = perf_counter() - start
+      with Stats.lock:
+        entry = Stats.phases.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+  @staticmethod
+  @contextmanager
+  def command(name:str) -> Iterator[None]:
+    """ Time a whole REPL command into its latency histogram """
+    counter = [0]
+    token = Stats.command_calls.set(counter)
+    start = perf_counter()
+    try:
+      yield
+    finally:
+      millis = (perf_counter() - start) * 1000
+      Stats.command_calls.reset(token)
+      with Stats.lock:
+        entry = Stats.commands.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0, "calls": 0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1)})
+        entry["count"] += 1
+        entry["sum"] += millis
+        entry["max"] = max(entry["max"], millis)
+        entry["calls"] += counter[0]
+        entry["buckets"][Stats._bucket(millis)] += 1
+
+  @staticmethod
+  def reset() -> None:
+    with Stats.lock:
+      Stats.calls.clear()
+      Stats.phases.clear()
+      Stats.commands.clear()
+      Stats.background_calls = 0
+
+  @staticmethod
+  def report() -> List[List[List[str]]]:
+    """ Commands, api calls and phases, each as a printable table """
+    with Stats.lock:
+      commands = [["Command", "Count", "Avg_ms", "Max_ms", "Calls/cmd", "Histogram"]]
+      for name, x in sorted(Stats.commands.items()):
+        commands.append([name, str(x["count"]), f"{x['sum'] / x['count']:.1f}", f"{x['max']:.1f}", f"{x['calls'] / x['count']:.1f}", Stats._histogram(x["buckets"])])
+      if Stats.background_calls:
+        commands.append([BACKGROUND, "", "", "", str(Stats.background_calls), ""])
+      calls = [["Api_call", "Count", "Total_ms", "Avg_ms", "Bytes"]]
+      for name, (count, seconds, size) in sorted(Stats.calls.items()):
+        calls.append([name, str(count), f"{seconds * 1000:.1f}", f"{seconds * 1000 / count:.1f}", str(size)])
+      phases = [["Phase", "Count", "Total_ms", "Avg_ms"]]
+      for name, (count, seconds) in sorted(Stats.phases.items()):
+        phases.append([name, str(count), f"{seconds * 1000:.1f}", f"{seconds * 1000 / count:.1f}"])
+    return [commands, calls, phases]
+
+  @staticmethod
+  def to_dict() -> dict[str, Any]:
+    with Stats.lock:
+      return {
+        "buckets_ms": LATENCY_BUCKETS,
+        "commands": json.loads(json.dumps(Stats.commands)),
+        "background_calls": Stats.background_calls,
+        "calls": {k: {"count": v[0], "seconds": v[1], "bytes": v[2]} for k, v in Stats.calls.items()},
+        "phases": {k: {"count": v[0], "seconds": v[1]} for k, v in Stats.phases.items()},
+      }
+
+  @staticmethod
+  def export(file_name:str) -> None:
+    """ Writes json for .json files, otherwise the Prometheus textfile format """
+    if path.splitext(file_name)[1].lower() == ".json":
+      content = json.dumps(Stats.to_dict(), indent=2)
+    else:
+      content = Stats.prometheus()
+    # textfile collectors may read at any time, never show them a partial file
+    temp_name = f"{file_name}.tmp"
+    with open(temp_name, "w") as f:
+      f.write(content)
+    replace(temp_name, file_name)
+
+  @staticmethod
+  def prometheus() -> str:
+    data = Stats.to_dict()
+    lines = [
+      "# HELP smartsheet_todo_command_seconds Latency of REPL commands.",
+      "# TYPE smartsheet_todo_command_seconds histogram",
+    ]
+    for name, x in data["commands"].items():
+      total = 0
+      label = Stats._label(name)
+      for bound, count in zip(LATENCY_BUCKETS + ["+Inf"], x["buckets"]):
+        total += count
+        le = bound if bound == "+Inf" else bound / 1000
+        lines.append(f'smartsheet_todo_command_seconds_bucket{{command="{label}",le="{le}"}} {total}')
+      lines.append(f'smartsheet_todo_command_seconds_sum{{command="{label}"}} {x["sum"] / 1000}')
+      lines.append(f'smartsheet_todo_command_seconds_count{{command="{label}"}} {x["count"]}')
+    lines += [
+      "# HELP smartsheet_todo_command_api_calls_total Smartsheet API calls made by REPL commands, and in the background.",
+      "# TYPE smartsheet_todo_command_api_calls_total counter",
+    ]
+    lines += [f'smartsheet_todo_command_api_calls_total{{command="{Stats._label(k)}"}} {v["calls"]}' for k, v in data["commands"].items()]
+    lines.append(f'smartsheet_todo_command_api_calls_total{{command="{BACKGROUND}"}} {data["background_calls"]}')
+    lines += [
+      "# HELP smartsheet_todo_api_calls_total Smartsheet API calls.",
+      "# TYPE smartsheet_todo_api_calls_total counter",
+    ]
+    lines += [f'smartsheet_todo_api_calls_total{{call="{Stats._label(k)}"}} {v["count"]}' for k, v in data["calls"].items()]
+    lines += [
+      "# HELP smartsheet_todo_api_seconds_total Time spent in Smartsheet API calls.",
+      "# TYPE smartsheet_todo_api_seconds_total counter",
+    ]
+    lines += [f'smartsheet_todo_api_seconds_total{{call="{Stats._label(k)}"}} {v["seconds"]}' for k, v in data["calls"].items()]
+    lines += [
+      "# HELP smartsheet_todo_api_bytes_total Bytes returned by Smartsheet API calls.",
+      "# TYPE smartsheet_todo_api_bytes_total counter",
+    ]
+    lines += [f'smartsheet_todo_api_bytes_total{{call="{Stats._label(k)}"}} {v["bytes"]}' for k, v in data["calls"].items()]
+    lines += [
+      "# HELP smartsheet_todo_phase_seconds_total Time spent in local phases.",
+      "# TYPE smartsheet_todo_phase_seconds_total counter",
+    ]
+    lines += [f'smartsheet_todo_phase_seconds_total{{phase="{Stats._label(k)}"}} {v["seconds"]}' for k, v in data["phases"].items()]
+    return "\n".join(lines) + "\n"
+
+  @staticmethod
+  def _label(value:str) -> str:
+    """ Label value escaped as the Prometheus text format requires """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+  @staticmethod
+  def _bucket(millis:float) -> int:
+    for i, bound in enumerate(LATENCY_BUCKETS):
+      if millis <= bound:
+        return i
+    return len(LATENCY_BUCKETS)
+
+  @staticmethod
+  def _histogram(buckets:List[int]) -> str:
+    """ Non empty buckets as <=bound:count """
+    bounds = [f"<={x}" for x in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}"]
+    return " ".join(f"{bound}:{count}" for bound, count in zip(bounds, buckets) if count)
@@ -1,75 +1,487 @@
-from smartsheet import Smartsheet
-from smartsheet.models import Sheet
-from smartsheet.models.row import Row
-from smartsheet.models.enums.column_type import ColumnType
-from typing import List, Any
+from __future__ import annotations
+from typing import TYPE_CHECKING, Callable, Iterable, List, Any
 from enum import Enum
 from datetime import date
-from . import Util
+from time import monotonic
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right, insort
+from . import Util, Stats, Executor, SearchIndex, ColumnarView
+if TYPE_CHECKING:
+  # the SDK loads with the client, see LazySmartsheet
+  from smartsheet import Smartsheet
+  from smartsheet.models import Sheet
+  from smartsheet.models.row import Row
+  from smartsheet.models.column import Column
+  from .journal import Journal
+
+MAX_ROWS_PER_REQUEST = 500
+# row ids of a delete go in the url, keep it well under its length limit
+MAX_ROW_IDS_PER_DELETE = 400
+DATE_TYPE = "DATE"
 
 class TableObjectFieldNames(Enum):
   """ Cell object field names """
   OBJECT_TYPE = "objectType"
   VALUE = "value"
 
+class SortedIndex:
+  """ Rows ordered by the value of a column, rows without a value last, equal values in sheet order """
+
+  def __init__(self) -> None:
+    # (0, value, position) for rows with a value, (1, "", position) for the others
+    self.keys:List[tuple] = []
+    # position -> row
+    self.rows:dict[int, Row] = {}
+
+  def add(self, value:Any, position:int, row:Row) -> None:
+    insort(self.keys, SortedIndex._key(value, position))
+    self.rows[position] = row
+
+  def remove(self, value:Any, position:int) -> None:
+    key = SortedIndex._key(value, position)
+    i = bisect_left(self.keys, key)
+    if i < len(self.keys) and self.keys[i] == key:
+      del self.keys[i]
+      del self.rows[position]
+
+  def range(self, after:Any=None, before:Any=None) -> List[Row]:
+    """ Rows with a value strictly between after and before, either bound may be left out """
+    start = 0 if after is None else bisect_right(self.keys, (0, after, float("inf")))
+    end = bisect_left(self.keys, (1,)) if before is None else bisect_left(self.keys, (0, before, -1))
+    return [self.rows[x[2]] for x in self.keys[start:end]]
+
+  @staticmethod
+  def _key(value:Any, position:int) -> tuple:
+    return (1, "", position) if value is None else (0, value, position)
+
 class Table:
   """ Represents table """
 
-  def __init__(self, smart:Smartsheet, sheet:Sheet) -> None:
+  def __init__(self, smart:Smartsheet, sheet:Sheet, columns:List[Column]|None=None, projection:List[str]|None=None, executor:Executor|None=None) -> None:
+    """ columns are all columns of the sheet when it was fetched with only the projection columns,
+    the chunks of a write are sent concurrently through executor when given """
     self.smart = smart
     self.sheet = sheet
     self.rows = sheet.rows
+    self.id = sheet.id
     self.name = sheet.name
+    self.version = sheet.version
     self.row_count = sheet.total_row_count
-    self.title_to_id = {x.title:x.id for x in sheet.columns}
+    self.title_to_id = {x.title:x.id for x in (columns or sheet.columns)}
+    self.projection = None if projection is None else set(projection)
+    # cache bookkeeping, see Database.get_table
+    self.checked_at = monotonic()
+    self.stale = False
+    # when the rows were fetched, see Database._sync
+    self.synced_at = None
+    # column title -> display value -> row, built lazily by _index
+    self.indexes:dict[str, dict[str, Row]] = {}
+    # (column title, unless column title) -> SortedIndex, built lazily by sorted_index
+    self.sorted_indexes:dict[tuple[str, str|None], SortedIndex] = {}
+    # row id -> order the row was first seen in, keeps equal values of a SortedIndex in sheet order
+    self.positions:dict[int, int] = {}
+    # row id -> row, built lazily by find_rows
+    self.by_id:dict[int, Row]|None = None
+    # indexed column titles -> SearchIndex, built lazily by text_index
+    self.text_indexes:dict[tuple[str, ...], SearchIndex] = {}
+    # column titles -> ColumnarView, dropped whenever a row changes, see columnar
+    self.views:dict[tuple, ColumnarView] = {}
+    # where text_index keeps its index between runs, set by Database
+    self.text_index_file:str|None = None
+    # staged cell changes by row id, sent by commit
+    self.pending:dict[int, Row] = {}
+    self.batch_depth = 0
+    self.executor = executor
+    # messages of failed writes, see Controller.take_errors
+    self.errors:List[str] = []
+    # called with the table after every write, see Database.start_refresher
+    self.on_write:Callable[[Table], None]|None = None
+    # writes go through it instead of straight to the sheet when set, see Journal
+    self.journal:Journal|None = None
 
   def insert_row(self, row:dict[str, Any]) -> None:
-    new_row = self.smart.models.Row()
-    for col_name, col_value in row.items():
-      new_cell = self.smart.models.Cell()
-      new_cell.column_id = self.title_to_id[col_name]
+    self.insert_rows([row])
 
-      if isinstance(col_value, date):
-        val = Util.date_as_str(col_value)
-        new_cell.object_value = {TableObjectFieldNames.OBJECT_TYPE.value: ColumnType.DATE.name, TableObjectFieldNames.VALUE.value: val}
+  def insert_rows(self, rows:List[dict[str, Any]]) -> List[str]:
+    """ Insert rows, one add_rows call per chunk, returns the error of each failed chunk """
+    return [x for x in self.insert_chunks(Util.chunks(rows, MAX_ROWS_PER_REQUEST)) if x is not None]
+
+  def insert_chunks(self, chunks:Iterable[List[dict[str, Any]]]) -> List[str|None]:
+    """ One add_rows call per chunk, returns the error of each chunk, None for the ones added """
+    if self.journal is not None:
+      chunks = list(chunks)
+      self.apply_local(self.journal.insert(self, [self._new_row(x) for chunk in chunks for x in chunk]), [])
+      return [None for _ in chunks]
+    errors = []
+    add_rows = lambda chunk: self.smart.Sheets.add_rows(self.id, list(map(self._new_row, chunk)))
+    responses = self._send(add_rows, chunks)
+    for response in responses:
+      if self._apply_write(response):
+        self._add_rows(response.result)
+        errors.append(None)
       else:
-        new_cell.value = col_value
-      new_row.cells.append(new_cell)
-    self.sheet.add_rows([new_row])
+        errors.append(response.result.message)
+    self._apply_versions(responses)
+    return errors
 
   def update_field(self, row_id:str, field_name:str, field_value:Any) -> None:
-    new_row = self.smart.models.Row()
-    new_row.id = row_id
+    """ Update a cell, sent right away unless inside a batch """
+    self.stage(row_id, field_name, field_value)
+    if self.batch_depth == 0:
+      self.commit()
+
+  def stage(self, row_id:str, field_name:str, field_value:Any) -> None:
+    """ Stage a cell change for the next commit """
     new_cell = self.smart.models.Cell()
     new_cell.column_id = self.title_to_id[field_name]
 
     if isinstance(field_value, date):
       val = Util.date_as_str(field_value)
-      new_cell.object_value = {TableObjectFieldNames.OBJECT_TYPE.value: ColumnType.DATE.name, TableObjectFieldNames.VALUE.value: val}
+      new_cell.object_value = {TableObjectFieldNames.OBJECT_TYPE.value: DATE_TYPE, TableObjectFieldNames.VALUE.value: val}
     elif field_value is None:
       new_cell.value = ""
     else:
       new_cell.value = field_value
-    new_row.cells.append(new_cell)
-    self.smart.Sheets.update_rows(self.sheet.id, [new_row])
+
+    new_row = self.pending.get(row_id)
+    if new_row is None:
+      new_row = self.smart.models.Row()
+      new_row.id = row_id
+      self.pending[row_id] = new_row
+    # last staged value for a column wins
+    new_row.cells = [x for x in new_row.cells if x.column_id != new_cell.column_id] + [new_cell]
+
+  def commit(self) -> None:
+    """ Send all staged changes, one update_rows call per chunk of rows """
+    rows = list(self.pending.values())
+    self.pending.clear()
+    if self.journal is not None:
+      self.apply_local(self.journal.update(self, rows), [])
+      return
+    update_rows = lambda chunk: self.smart.Sheets.update_rows(self.id, chunk)
+    responses = self._send(update_rows, Util.chunks(rows, MAX_ROWS_PER_REQUEST))
+    for response in responses:
+      if self._apply_write(response):
+        self._replace_rows(response.result)
+    self._apply_versions(responses)
+
+  @contextmanager
+  def batch(self):
+    """ Coalesce every update_field in the block into one commit """
+    self.batch_depth += 1
+    try:
+      yield self
+    except BaseException:
+      self.pending.clear()
+      raise
+    finally:
+      self.batch_depth -= 1
+    if self.batch_depth == 0:
+      self.commit()
 
   def delete_row(self, ids:List[str]) -> None:
-    self.sheet.delete_rows(ids)
-
-  def find_by_id(self, class_obj:Any, field_names:dict[str, str], id:str) -> Any:
-    for x in self.map_rows(class_obj, field_names):
-      if x.id == id:
-        return x
-    return None
-
-  def map_rows(self, class_obj:Any, field_names:dict[str, str]) -> List[Any]:
-    return list(map(lambda row: self._map(class_obj, field_names, row), self.rows))
-
-  def _map(self, class_obj:Any, field_names:dict[str, str], row:Row) -> Any:
-    id_lookup = self.title_to_id
-    x = class_obj(self)
-    x.table = self
-    x.row = row
-    for key, value in field_names.items():
-      setattr(x, value, row.get_column(id_lookup[key]))
-    return x
+    if self.journal is not None:
+      self.journal.delete(self, ids)
+      self.apply_local([], ids)
+      return
+    chunks = list(Util.chunks(ids, MAX_ROW_IDS_PER_DELETE))
+    delete_rows = lambda chunk: self.smart.Sheets.delete_rows(self.id, chunk)
+    responses = self._send(delete_rows, chunks)
+    for chunk, response in zip(chunks, responses):
+      if self._apply_write(response):
+        self._remove_rows(chunk)
+    self._apply_versions(responses)
+
+  def move_rows(self, ids:List[int], destination:"Table") -> List[str]:
+    """ Move rows to the destination sheet, one move_rows call per chunk, returns the error of each failed chunk """
+    errors = []
+    chunks = list(Util.chunks(ids, MAX_ROWS_PER_REQUEST))
+    directive = lambda chunk: self.smart.models.CopyOrMoveRowDirective({"rowIds": chunk, "to": {"sheetId": destination.id}})
+    move_rows = lambda chunk: self.smart.Sheets.move_rows(self.id, directive(chunk))
+    moved = 0
+    for chunk, response in zip(chunks, self._send(move_rows, chunks)):
+      if isinstance(response, self.smart.models.Error):
+        errors.append(response.result.message)
+        self.errors.append(response.result.message)
+      else:
+        self._remove_rows(chunk)
+        moved += 1
+    # the move result carries no sheet versions, the moved rows are already dropped here
+    destination.stale = True
+    response = self.smart.Sheets.get_sheet_version(self.id)
+    # anything but one version per move means someone else changed the sheet too
+    if len(errors) or isinstance(response, self.smart.models.Error) or self.version is None or response.version != self.version + moved:
+      self.stale = True
+    else:
+      self.version = response.version
+      self.row_count = len(self.rows)
+      self.checked_at = monotonic()
+    self._written()
+    return errors
+
+  def projected_column_ids(self) -> List[int]|None:
+    if self.projection is None:
+      return None
+    return [self.title_to_id[x] for x in self.projection]
+
+  def apply_delta(self, rows:List[Row], live_ids:set[int]|None, version:int) -> None:
+    """ Merge changed rows into the loaded ones and drop the rows that no longer exist, none when live_ids is None """
+    known = set(map(lambda x: x.id, self.rows))
+    self._replace_rows([x for x in rows if x.id in known])
+    self._add_rows([x for x in rows if x.id not in known and (live_ids is None or x.id in live_ids)])
+    if live_ids is not None:
+      self._remove_rows([x.id for x in self.rows if x.id not in live_ids])
+    self.version = version
+    self.row_count = len(self.rows)
+    self.checked_at = monotonic()
+
+  def apply_changes(self, rows:List[Row], deleted:set[int], version:int|None) -> None:
+    """ Swap in rows as the sheet holds them now, adding unknown ones, and drop deleted rows """
+    known = {x.id for x in self.find_rows(x.id for x in rows)}
+    self._replace_rows([x for x in rows if x.id in known])
+    self._add_rows([x for x in rows if x.id not in known])
+    if len(deleted):
+      self._remove_rows(list(deleted))
+    if version is not None and (self.version is None or version > self.version):
+      self.version = version
+    self.row_count = len(self.rows)
+    self.checked_at = monotonic()
+
+  def apply_local(self, rows:List[Row], deleted:List[int]) -> None:
+    """ Patch the loaded rows with writes not sent yet, rows hold the changed cells, unknown rows are added """
+    known = {x.id:x for x in self.find_rows(x.id for x in rows)}
+    merged = [self._merge(known.get(x.id), x) for x in rows]
+    if len(known):
+      self._replace_rows([x for x in merged if x.id in known])
+    self._add_rows([x for x in merged if x.id not in known])
+    if len(deleted):
+      self._remove_rows(deleted)
+
+  def resolve_rows(self, temporary:List[int], rows:List[Row], version:int|None) -> None:
+    """ Swap the rows added by apply_local for the ones the sheet added, once sent """
+    present = [x.id for x in self.find_rows(temporary)]
+    if len(present):
+      self._remove_rows(present)
+    known = {x.id for x in self.find_rows(x.id for x in rows)}
+    self._add_rows([x for x in rows if x.id not in known])
+    if version is not None and self.version is not None and version == self.version + 1:
+      self.version = version
+    elif version is None or self.version is None or version > self.version:
+      # someone else changed the sheet too, a version already past the write holds it
+      self.stale = True
+
+  def find_by_id(self, class_obj:Any, id:str, id_field:str) -> Any:
+    """ Map only the row whose id_field column displays id """
+    row = self._index(id_field).get(id)
+    if row is None:
+      return None
+    return self._map(class_obj, row)
+
+  def map_rows(self, class_obj:Any, rows:List[Row]|None=None) -> List[Any]:
+    """ Map the given rows, all loaded rows by default """
+    if rows is None:
+      rows = self.rows
+    with Stats.phase("map_rows"):
+      return list(map(lambda row: self._map(class_obj, row), rows))
+
+  def has_columns(self, columns:List[str]|None) -> bool:
+    """ Whether the loaded rows hold the given columns, None meaning all of them """
+    if self.projection is None:
+      return True
+    return columns is not None and set(columns) <= self.projection
+
+  def _apply_write(self, response:Any) -> bool:
+    """ Record a failed write, returns whether local rows can be patched """
+    if isinstance(response, self.smart.models.Error):
+      self.stale = True
+      self.errors.append(response.result.message)
+      return False
+    return True
+
+  def _apply_versions(self, responses:List[Any]) -> None:
+    """ Move to the version after the writes when they are the only changes made to the sheet since it was read,
+    otherwise the changes of someone else are missing here and the next read downloads the sheet again """
+    versions = [x.version for x in responses if not isinstance(x, self.smart.models.Error)]
+    # concurrent chunks may answer out of order, each of them adds one version
+    expected = None if self.version is None else list(range(self.version + 1, self.version + 1 + len(versions)))
+    if None in versions or sorted(versions) != expected:
+      self.stale = True
+    elif len(versions):
+      self.version = max(versions)
+      self.checked_at = monotonic()
+    self._written()
+
+  def _written(self) -> None:
+    if self.on_write is not None:
+      self.on_write(self)
+
+  def _send(self, request:Any, chunks:Any) -> List[Any]:
+    """ One request per chunk, concurrently when the table has an executor, responses in chunk order """
+    if self.executor is None:
+      return list(map(request, chunks))
+    return self.executor.map(request, chunks)
+
+  def _new_row(self, row:dict[str, Any]) -> Row:
+    new_row = self.smart.models.Row()
+    for col_name, col_value in row.items():
+      new_cell = self.smart.models.Cell()
+      new_cell.column_id = self.title_to_id[col_name]
+
+      if isinstance(col_value, date):
+        val = Util.date_as_str(col_value)
+        new_cell.object_value = {TableObjectFieldNames.OBJECT_TYPE.value: DATE_TYPE, TableObjectFieldNames.VALUE.value: val}
+      else:
+        new_cell.value = col_value
+      new_row.cells.append(new_cell)
+    return new_row
+
+  def _merge(self, row:Row|None, changes:Row) -> Row:
+    """ Copy of row with the cells of changes, as the sheet would show them """
+    merged = self.smart.models.Row()
+    merged.id = changes.id
+    changed = {x.column_id for x in changes.cells}
+    for cell in (row.cells if row is not None else []):
+      if cell.column_id not in changed:
+        merged.cells.append(cell)
+    for cell in changes.cells:
+      value = cell.value if cell.object_value is None else cell.object_value.value
+      if isinstance(value, date):
+        value = Util.date_as_str(value)
+      local = self.smart.models.Cell()
+      local.column_id = cell.column_id
+      if value is not None and value != "":
+        local.value = value
+        local.display_value = str(value)
+      merged.cells.append(local)
+    return merged
+
+  def sorted_index(self, field_name:str, unless:str|None=None) -> SortedIndex:
+    """ Rows ordered by the value of field_name, leaving out the rows with a value in unless,
+    kept up to date by every write so a listing only costs the rows it returns """
+    key = (field_name, unless)
+    if key not in self.sorted_indexes:
+      index = SortedIndex()
+      for row in self.rows:
+        self._sort_row(key, index, row)
+      self.sorted_indexes[key] = index
+    return self.sorted_indexes[key]
+
+  def find_rows(self, row_ids:Iterable[int]) -> List[Row]:
+    """ Loaded rows with the given ids, in the order given """
+    if self.by_id is None:
+      self.by_id = {x.id:x for x in self.rows}
+    return [self.by_id[x] for x in row_ids if x in self.by_id]
+
+  def text_index(self, fields:dict[str, float]) -> SearchIndex:
+    """ Full text index over the fields (column title -> weight), loaded from text_index_file when saved
+    at the version of the sheet, saved there in the background whenever the sheet moved on since """
+    key = tuple(fields)
+    # an index of a projection missing some fields is not worth keeping
+    file_name = self.text_index_file if self.has_columns(list(key)) else None
+    index = self.text_indexes.get(key)
+    if index is None and file_name is not None:
+      index = SearchIndex.load(file_name, fields, self.version)
+    if index is None:
+      index = SearchIndex(fields)
+      for row in self.rows:
+        index.add(row.id, [self.value(row, x) for x in key])
+    self.text_indexes[key] = index
+    if file_name is not None and index.saved_version != self.version:
+      index.saved_version = self.version
+      if self.executor is None:
+        index.save(file_name, self.version)
+      else:
+        self.executor.submit(index.save, file_name, self.version)
+    return index
+
+  def columnar(self, dates:List[str], codes:dict[str, Any], texts:dict[str, Any]) -> ColumnarView:
+    """ Columnar view of the loaded rows, see ColumnarView, built again once any of them changed """
+    key = (tuple(dates), tuple(codes), tuple(texts))
+    if key not in self.views:
+      with Stats.phase("columnar"):
+        self.views[key] = ColumnarView(self.rows, self.title_to_id, dates, codes, texts)
+    return self.views[key]
+
+  def value(self, row:Row, field_name:str) -> Any:
+    """ Cell value, None when empty or the column was not fetched """
+    column_id = self.title_to_id.get(field_name)
+    cell = None if column_id is None else row.get_column(column_id)
+    if cell is None or cell.value is None or cell.value == "":
+      return None
+    return cell.value
+
+  def position(self, row:Row) -> int:
+    """ Order the row was first seen in, the order of the sheet for loaded and added rows """
+    return self.positions.setdefault(row.id, len(self.positions))
+
+  def _sort_row(self, key:tuple[str, str|None], index:SortedIndex, row:Row) -> None:
+    field_name, unless = key
+    if unless is None or self.value(row, unless) is None:
+      index.add(self.value(row, field_name), self.position(row), row)
+
+  def _unsort_row(self, key:tuple[str, str|None], index:SortedIndex, row:Row) -> None:
+    field_name, unless = key
+    if unless is None or self.value(row, unless) is None:
+      index.remove(self.value(row, field_name), self.position(row))
+
+  def _index(self, field_name:str) -> dict[str, Row]:
+    if field_name not in self.indexes:
+      column_id = self.title_to_id[field_name]
+      index = {}
+      for row in self.rows:
+        cell = row.get_column(column_id)
+        if cell is not None and cell.display_value is not None:
+          index[cell.display_value] = row
+      self.indexes[field_name] = index
+    return self.indexes[field_name]
+
+  def _index_row(self, row:Row) -> None:
+    self.views.clear()
+    for field_name, index in self.indexes.items():
+      cell = row.get_column(self.title_to_id[field_name])
+      if cell is not None and cell.display_value is not None:
+        index[cell.display_value] = row
+    for key, sorted_index in self.sorted_indexes.items():
+      self._sort_row(key, sorted_index, row)
+    if self.by_id is not None:
+      self.by_id[row.id] = row
+    for fields, text_index in self.text_indexes.items():
+      text_index.add(row.id, [self.value(row, x) for x in fields])
+
+  def _unindex_row(self, row:Row) -> None:
+    self.views.clear()
+    for field_name, index in self.indexes.items():
+      cell = row.get_column(self.title_to_id[field_name])
+      if cell is not None and index.get(cell.display_value) is row:
+        del index[cell.display_value]
+    for key, sorted_index in self.sorted_indexes.items():
+      self._unsort_row(key, sorted_index, row)
+    if self.by_id is not None and self.by_id.get(row.id) is row:
+      del self.by_id[row.id]
+    for fields, text_index in self.text_indexes.items():
+      text_index.remove(row.id, [self.value(row, x) for x in fields])
+
+  def _add_rows(self, rows:List[Row]) -> None:
+    self.rows.extend(rows)
+    for row in rows:
+      self._index_row(row)
+
+  def _replace_rows(self, rows:List[Row]) -> None:
+    updated = {x.id:x for x in rows}
+    for i, row in enumerate(self.rows):
+      new_row = updated.get(row.id)
+      if new_row is not None:
+        self._unindex_row(row)
+        self.rows[i] = new_row
+        self._index_row(new_row)
+
+  def _remove_rows(self, ids:List[str]) -> None:
+    deleted = set(ids)
+    for row in self.rows:
+      if row.id in deleted:
+        self._unindex_row(row)
+    self.rows = [x for x in self.rows if x.id not in deleted]
+
+  def _map(self, class_obj:Any, row:Row) -> Any:
+    """ class_obj reads its fields from the row itself """
+    return class_obj.from_row(self, row)
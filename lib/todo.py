@@ -1,8 +1,11 @@
-from smartsheet import Smartsheet
+from __future__ import annotations
 from datetime import date, datetime, timedelta
 from enum import Enum
-from typing import List, Self
-from . import Table, Util
+import heapq
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Self, Any
+from . import Table, Util, Stats, ColumnarView
+if TYPE_CHECKING:
+  from smartsheet import Smartsheet
 
 class TodoStatusType(Enum):
   BACKLOG = "Backlog"
@@ -15,6 +18,14 @@ class TodoFilterType(Enum):
   ALL = "ALL"
   WEEK = "WEEK"
   UNFINISHED = "UNFINISHED"
+  OVERDUE = "OVERDUE"
+
+PRINT_TABLE_HEADER = ["Id", "Task", "Status", "Due_Date", "Completed_At"]
+
+class TodoSelectorFilter(Enum):
+  """ Filters usable when selecting todos by expression """
+  STATUS = "status"
+  TASK = "task"
 
 class TodoFieldNames(Enum):
   """ Todo Schema """
@@ -31,24 +42,79 @@ class TodoFieldNames(Enum):
   STATUS = "Status"
   STATUS_TYPE = "PICKLIST"
 
+# columns needed to list and select todos, everything but the notes
+LIST_COLUMNS = [TodoFieldNames.ID.value, TodoFieldNames.TASK_NAME.value, TodoFieldNames.STATUS.value, TodoFieldNames.DUE_DATE.value, TodoFieldNames.COMPLETED_AT.value]
+
+# columns searched and the weight of a match in each
+SEARCH_FIELDS = {TodoFieldNames.TASK_NAME.value: 2.0, TodoFieldNames.NOTES.value: 1.0}
+
+# marks a field not read from its row yet
+UNSET = object()
+
+class TodoField:
+  """ Todo attribute read from its row cell on first access """
+
+  def __init__(self, column:TodoFieldNames, is_date:bool=False, default:Any=None) -> None:
+    self.column = column.value
+    self.is_date = is_date
+    self.default = default
+
+  def __set_name__(self, owner:Any, name:str) -> None:
+    self.slot = f"_{name}"
+
+  def __get__(self, todo:Any, owner:Any=None) -> Any:
+    if todo is None:
+      return self
+    value = getattr(todo, self.slot)
+    if value is UNSET:
+      value = self._load(todo)
+      setattr(todo, self.slot, value)
+    return value
+
+  def __set__(self, todo:Any, value:Any) -> None:
+    setattr(todo, self.slot, value)
+
+  def _load(self, todo:Any) -> Any:
+    cell = todo.cell(self.column)
+    if self.is_date:
+      if cell is not None and cell.value is not None and cell.value != "":
+        return Util.parse_date(cell.value)
+      return None
+    if cell is None:
+      return self.default
+    return cell.display_value
+
 class Todo:
   """ Todo """
+  __slots__ = ("table", "row", "_id", "_task", "_due_date", "_completed_at", "_notes", "_status")
+
+  id = TodoField(TodoFieldNames.ID)
+  task = TodoField(TodoFieldNames.TASK_NAME)
+  due_date = TodoField(TodoFieldNames.DUE_DATE, is_date=True)
+  completed_at = TodoField(TodoFieldNames.COMPLETED_AT, is_date=True)
+  notes = TodoField(TodoFieldNames.NOTES)
+  status = TodoField(TodoFieldNames.STATUS, default=TodoStatusType.BACKLOG.value)
 
   def __init__(self, table:Table, task:str|None=None, due_date:date|None=None, notes:str|None=None) -> None:
     self.id = None
     self.row = None
-    self.task_object = None
-    self.due_date_object = None
-    self.completed_at_object = None
-    self.id_object = None
-    self.notes_object = None
-    self.status_object = None
     self.table:Table = table
     self.task:str|None = task
     self.due_date:date|None = due_date
+    self.completed_at:date|None = None
     self.notes:str|None = notes
     self.status:str = TodoStatusType.BACKLOG.value
 
+  @staticmethod
+  def from_row(table:Table, row:Any) -> Self:
+    """ Todo backed by a loaded row, fields are parsed when first used """
+    todo = Todo.__new__(Todo)
+    todo.table = table
+    todo.row = row
+    for slot in Todo.__slots__[2:]:
+      setattr(todo, slot, UNSET)
+    return todo
+
   def __str__(self) -> str:
     return f"Todo: {{ id: {self.id}, task: {self.task}, due_date: {self.due_date}, completed_at: {self.completed_at}, notes: {self.notes} }}"
 
@@ -64,75 +130,47 @@ class Todo:
     status: {self.status}
     notes: {notes.replace(r'\n', '\n')}''')
 
-  @property
-  def id_object(self):
-    return self._id_object
-
-  @id_object.setter
-  def id_object(self, value):
-    if value is not None:
-      self.id = value.display_value
-    self._id_object = value
-
-  @property
-  def task_object(self):
-    return self._task_object
-
-  @task_object.setter
-  def task_object(self, value):
-    if value is not None:
-      self.task = value.display_value
-    self._task_object = value
-
-  @property
-  def due_date_object(self):
-    return self._due_date_object
-
-  @due_date_object.setter
-  def due_date_object(self, value):
-    self._due_date_object = value
-    if value is not None and value.value is not None and value.value != "":
-      self.due_date = Util.parse_date(value.value)
-    else:
-      self.due_date = None
-
-  @property
-  def completed_at_object(self):
-    return self._completed_at_object
-
-  @completed_at_object.setter
-  def completed_at_object(self, value):
-    self._completed_at_object = value
-    if value is not None and value.value is not None and value.value != "":
-      self.completed_at = Util.parse_date(value.value)
-    else:
-      self.completed_at = None
-
-  @property
-  def notes_object(self):
-      return self._notes_object
-
-  @notes_object.setter
-  def notes_object(self, value):
-    if value is not None:
-      self.notes = value.display_value
-    self._notes_object = value
-
-  @property
-  def status_object(self):
-      return self._status_object
+  def as_dict(self) -> dict[str, str|None]:
+    """ Fields as json friendly strings """
+    as_str = lambda x: None if x is None else str(x)
+    return {
+      "id": as_str(self.id),
+      "task": as_str(self.task),
+      "status": as_str(self.status),
+      "due_date": as_str(self.due_date),
+      "completed_at": as_str(self.completed_at),
+      "notes": as_str(self.notes),
+    }
 
-  @status_object.setter
-  def status_object(self, value):
-    if value is not None:
-      self.status = value.display_value
-    self._status_object = value
+  def cell(self, field_name:str) -> Any:
+    """ Cell of the row, None when the column was not fetched """
+    column_id = self.table.title_to_id.get(field_name)
+    if self.row is None or column_id is None:
+      return None
+    return self.row.get_column(column_id)
 
   def is_completed(self) -> bool:
     return self.completed_at is not None
 
+  def matches(self, filters:dict[str, str]) -> bool:
+    """ status must be equal, task must contain the value, both ignore case """
+    for key, value in filters.items():
+      value = value.lower()
+      match TodoSelectorFilter(key):
+        case TodoSelectorFilter.STATUS:
+          if str(self.status).lower() != value:
+            return False
+        case TodoSelectorFilter.TASK:
+          if value not in str(self.task).lower():
+            return False
+    return True
+
   def save(self) -> None:
     """ Save todo """
+    self.table.insert_row(self.to_row())
+
+  def to_row(self) -> dict[str, str]:
+    """ Cell values of a new row for this todo """
     data = {
       TodoFieldNames.TASK_NAME.value: self.task
     }
@@ -140,9 +178,11 @@ class Todo:
       data[TodoFieldNames.NOTES.value] = self.notes
     if self.due_date is not None:
       data[TodoFieldNames.DUE_DATE.value] = Util.date_as_str(self.due_date)
+    if self.completed_at is not None:
+      data[TodoFieldNames.COMPLETED_AT.value] = Util.date_as_str(self.completed_at)
     if self.status is not None:
       data[TodoFieldNames.STATUS.value] = self.status
-    self.table.insert_row(data)
+    return data
 
   def delete(self) -> None:
     """ Delete todo """
@@ -158,8 +198,9 @@ class Todo:
       return
     self.completed_at = datetime.now().date()
     self.status = TodoStatusType.DONE.value
-    self.table.update_field(self.row.id, TodoFieldNames.COMPLETED_AT.value, self.completed_at)
-    self.table.update_field(self.row.id, TodoFieldNames.STATUS.value, self.status)
+    with self.table.batch():
+      self.table.update_field(self.row.id, TodoFieldNames.COMPLETED_AT.value, self.completed_at)
+      self.table.update_field(self.row.id, TodoFieldNames.STATUS.value, self.status)
 
   def unfinish(self, new_status:str=TodoStatusType.IN_PROGRESS.value) -> None:
     """ Mark as not finished """
@@ -168,8 +209,9 @@ class Todo:
       return
     self.completed_at = None
     self.status = new_status
-    self.table.update_field(self.row.id, TodoFieldNames.COMPLETED_AT.value, self.completed_at)
-    self.table.update_field(self.row.id, TodoFieldNames.STATUS.value, self.status)
+    with self.table.batch():
+      self.table.update_field(self.row.id, TodoFieldNames.COMPLETED_AT.value, self.completed_at)
+      self.table.update_field(self.row.id, TodoFieldNames.STATUS.value, self.status)
 
   def update_due_date_as_str(self, due_date:str) -> None:
     """ Set due date """
@@ -213,44 +255,125 @@ class Todo:
         self.finish()
 
   @staticmethod
-  def find_by_id(table:Table, id:str):
-    """ Find todo by id """
-    if table is not None:
-      return table.find_by_id(Todo, Todo._field_name_mappings(), id)
+  def find_by_id(table:Table|List[Table], id:str):
+    """ Find todo by id, in the first of several tables holding it """
+    for x in Todo._tables(table):
+      found = x.find_by_id(Todo, id, TodoFieldNames.ID.value)
+      if found is not None:
+        return found
     return None
 
   @staticmethod
-  def create_print_table(table:Table, todo_filter:TodoFilterType=TodoFilterType.UNFINISHED) -> List[List[str]]:
-    """ Filters all elements and creates structure for the todos to be nicely printed """
-    rows = Todo._rows(table)
-    if rows is None:
+  def find_all(table:Table|List[Table], ids:List[str], filters:dict[str, str]) -> tuple[List[Self], List[str]]:
+    """ Todos with the given ids (all todos when none given) that match the filters, and the ids not found """
+    if len(Todo._tables(table)) == 0:
+      return [], ids
+    if len(ids):
       todos = []
+      missing = []
+      for id in ids:
+        found = Todo.find_by_id(table, id)
+        if found is None:
+          missing.append(id)
+        else:
+          todos.append(found)
+    elif TodoSelectorFilter.STATUS.value in filters:
+      # only the todos with the status are mapped
+      todos = []
+      for x in Todo._tables(table):
+        view = Todo._view(x)
+        todos += x.map_rows(Todo, [view.rows[i] for i in Todo._scan(x, view, False, filters[TodoSelectorFilter.STATUS.value], None, None)])
+      missing = []
     else:
-      match todo_filter:
-        case TodoFilterType.ALL:
-          filter_func = lambda todo: True
-        case TodoFilterType.WEEK:
-          filter_func = Todo._week_filter
-        case TodoFilterType.UNFINISHED:
-          filter_func = lambda todo: not todo.is_completed()
-      max_date = date(3000, 1, 1)
-      todos = sorted(filter(filter_func, rows), key=lambda t: max_date if t.due_date is None else t.due_date)
-      todos = list(map(lambda todo: [str(todo.id), str(todo.task), str(todo.status), str(todo.due_date), str(todo.completed_at)], todos))
-    todos.insert(0, ["Id", "Task", "Status", "Due_Date", "Completed_At"])
-    return todos
+      todos = Todo._rows(table)
+      missing = []
+    return [x for x in todos if x.matches(filters)], missing
+
+  @staticmethod
+  def create_print_table(table:Table|List[Table], todo_filter:TodoFilterType=TodoFilterType.UNFINISHED, status:str|None=None, after:date|None=None, before:date|None=None, count:int|None=None) -> List[List[str]]:
+    """ Filters all elements and creates structure for the todos to be nicely printed,
+    only due dates strictly between after and before when given, read off the columnar views of the tables,
+    count limits the todos to the first ones, e.g. up to the page shown """
+    after, before = Todo.due_bounds(todo_filter, after, before)
+    due = TodoFieldNames.DUE_DATE.value
+    listed = []
+    with Stats.phase("filter_sort"):
+      for x in Todo._tables(table):
+        view = Todo._view(x)
+        listed.append([(view, i) for i in Todo._scan(x, view, todo_filter != TodoFilterType.ALL, status, after, before)])
+      # each table is already in due date order, only shards need merging
+      if len(listed) > 1:
+        listed = [list(heapq.merge(*listed, key=lambda x: x[0].dates[due][x[1]]))]
+    return Todo._print_positions((listed[0] if len(listed) else [])[:count])
 
   @staticmethod
-  def create_table(smart:Smartsheet, table_name:str, folder_id:str) -> Table:
-    sheet_spec = smart.models.Sheet({
+  def stream(tables:Iterable[Table], todo_filter:TodoFilterType=TodoFilterType.ALL, status:str|None=None, after:date|None=None, before:date|None=None) -> Iterator[Self]:
+    """ Todos of the listing in sheet order, made one page at a time from tables such as Database.stream_table yields """
+    after, before = Todo.due_bounds(todo_filter, after, before)
+    for table in tables:
+      for todo in table.map_rows(Todo):
+        if Todo._in_range(todo, todo_filter != TodoFilterType.ALL, status, after, before):
+          yield todo
+
+  @staticmethod
+  def print_table(rows:List[Self]|None, todo_filter:TodoFilterType=TodoFilterType.UNFINISHED, status:str|None=None, after:date|None=None, before:date|None=None) -> List[List[str]]:
+    """ create_print_table of todos already mapped, e.g. from a Snapshot """
+    if rows is None:
+      return Todo._print_rows([])
+    after, before = Todo.due_bounds(todo_filter, after, before)
+    with Stats.phase("filter_sort"):
+      todos = [x for x in rows if Todo._in_range(x, todo_filter != TodoFilterType.ALL, status, after, before)]
+      return Todo._print_rows(Todo._sorted(todos))
+
+  @staticmethod
+  def create_search_table(table:Table|List[Table], query:str) -> List[List[str]]:
+    """ Todos whose task or notes hold every term of the query, best match first, see SearchIndex.search """
+    found = []
+    with Stats.phase("search"):
+      for x in Todo._tables(table):
+        scores = dict(x.text_index(SEARCH_FIELDS).search(query))
+        found += [(scores[todo.row.id], todo) for todo in x.map_rows(Todo, x.find_rows(scores))]
+    return Todo._print_rows([todo for _, todo in sorted(found, key=lambda x: -x[0])])
+
+  @staticmethod
+  def due_bounds(todo_filter:TodoFilterType, after:date|None=None, before:date|None=None) -> tuple[date|None, date|None]:
+    """ Due dates a listing is limited to, both bounds excluded, computed once per listing """
+    today = datetime.now().date()
+    match todo_filter:
+      case TodoFilterType.WEEK:
+        # sunday to saturday
+        return today - timedelta(days = today.weekday() + 2), today - timedelta(days = today.weekday() - 6)
+      case TodoFilterType.OVERDUE:
+        return after, today if before is None else min(before, today)
+    return after, before
+
+  @staticmethod
+  def create_table(smart:Smartsheet, table_name:str, folder_id:str, archive:bool=False, prefix:str="") -> Any:
+    """ The new sheet, or the error the sheet was not created with """
+    response = smart.Folders.create_sheet_in_folder(folder_id, Todo.table_spec(smart, table_name, archive, prefix))
+    if isinstance(response, smart.models.Error):
+      return response
+    new_sheet = response.result
+    return new_sheet
+
+  @staticmethod
+  def table_spec(smart:Smartsheet, table_name:str, archive:bool=False, prefix:str="") -> Any:
+    """ Sheet definition with the todo columns, an archive keeps the ids of the rows moved into it """
+    id_column = {
+      "title": TodoFieldNames.ID.value,
+      "type": "TEXT_NUMBER",
+      "systemColumnType": TodoFieldNames.ID_TYPE.value,
+      "autoNumberFormat": {
+        "startingNumber": 1
+      }
+    }
+    if prefix:
+      id_column["autoNumberFormat"]["prefix"] = prefix
+    if archive:
+      id_column = {"title": TodoFieldNames.ID.value, "type": "TEXT_NUMBER"}
+    return smart.models.Sheet({
       "name": table_name,
-      "columns": [{
-        "title": TodoFieldNames.ID.value,
-        "type": "TEXT_NUMBER",
-        "systemColumnType": TodoFieldNames.ID_TYPE.value,
-        "autoNumberFormat": {
-          "startingNumber": 1
-        }
-      }, {
+      "columns": [id_column, {
         "title": TodoFieldNames.TASK_NAME.value,
         "type": TodoFieldNames.TASK_NAME_TYPE.value,
         "primary": True
@@ -286,34 +409,75 @@ class Todo:
       }]
     })
 
-    response = smart.Folders.create_sheet_in_folder(folder_id, sheet_spec)
-    new_sheet = response.result
-    return new_sheet
-
   """ Helper Methods """
   @staticmethod
-  def _week_filter(todo:Self) -> bool:
-    """ Things not yet done for this week """
-    now = datetime.now()
-    sunday = (now - timedelta(days = now.weekday() + 1)).date()
-    saturday = (now - timedelta(days = now.weekday() - 5)).date()
-    return todo.due_date is not None and not todo.is_completed() and todo.due_date >= sunday and todo.due_date <= saturday
+  def _view(table:Table) -> ColumnarView:
+    return table.columnar([TodoFieldNames.DUE_DATE.value, TodoFieldNames.COMPLETED_AT.value],
+      {TodoFieldNames.STATUS.value: TodoStatusType.BACKLOG.value}, {TodoFieldNames.ID.value: None, TodoFieldNames.TASK_NAME.value: None})
 
   @staticmethod
-  def _field_name_mappings() -> dict[str, str]:
-    """ External to internal field names """
-    return {
-      TodoFieldNames.TASK_NAME.value: "task_object",
-      TodoFieldNames.DUE_DATE.value: "due_date_object",
-      TodoFieldNames.ID.value: "id_object",
-      TodoFieldNames.COMPLETED_AT.value: "completed_at_object",
-      TodoFieldNames.NOTES.value: "notes_object",
-      TodoFieldNames.STATUS.value: "status_object",
-    }
+  def _scan(table:Table, view:ColumnarView, open_only:bool, status:str|None, after:date|None, before:date|None) -> List[int]:
+    """ Positions in the view of the rows of the listing in due date order, rows without one last """
+    due = TodoFieldNames.DUE_DATE.value
+    if status is None and (after is not None or before is not None):
+      # a date range is usually a small part of the sheet, read off the sorted index
+      index = table.sorted_index(due, TodoFieldNames.COMPLETED_AT.value if open_only else None)
+      return [view.position(x.id) for x in index.range(Todo._date_str(after), Todo._date_str(before))]
+    masks = []
+    if open_only:
+      masks.append(view.missing(TodoFieldNames.COMPLETED_AT.value))
+    if after is not None or before is not None:
+      masks.append(view.between(due, after, before))
+    if status is not None:
+      values = view.values[TodoFieldNames.STATUS.value]
+      masks.append(view.among(TodoFieldNames.STATUS.value, [x for x in values if str(x or TodoStatusType.BACKLOG.value).lower() == status.lower()]))
+    return view.sort(view.select(masks), due)
+
+  @staticmethod
+  def _in_range(todo:Self, open_only:bool, status:str|None, after:date|None, before:date|None) -> bool:
+    """ Same as _scan for a todo already mapped """
+    if open_only and todo.is_completed():
+      return False
+    if status is not None and str(todo.status).lower() != status.lower():
+      return False
+    if after is None and before is None:
+      return True
+    return todo.due_date is not None and (after is None or todo.due_date > after) and (before is None or todo.due_date < before)
+
+  @staticmethod
+  def _sorted(todos:List[Self]) -> List[Self]:
+    max_date = date(3000, 1, 1)
+    return sorted(todos, key=lambda t: max_date if t.due_date is None else t.due_date)
 
   @staticmethod
-  def _rows(table:Table):
-    """ Get all rows """
+  def _print_rows(todos:List[Self]) -> List[List[str]]:
+    rows = list(map(lambda todo: [str(todo.id), str(todo.task), str(todo.status), str(todo.due_date), str(todo.completed_at)], todos))
+    rows.insert(0, list(PRINT_TABLE_HEADER))
+    return rows
+
+  @staticmethod
+  def _print_positions(listed:List[tuple[ColumnarView, int]]) -> List[List[str]]:
+    """ _print_rows of rows in columnar views, only their strings are made """
+    todo_id, task, status, due, completed = [x.value for x in [TodoFieldNames.ID, TodoFieldNames.TASK_NAME, TodoFieldNames.STATUS, TodoFieldNames.DUE_DATE, TodoFieldNames.COMPLETED_AT]]
+    rows = [[str(view.value(todo_id, i)), str(view.value(task, i)), str(view.value(status, i)), str(view.date_str(due, i)), str(view.date_str(completed, i))] for view, i in listed]
+    rows.insert(0, list(PRINT_TABLE_HEADER))
+    return rows
+
+  @staticmethod
+  def _date_str(value:date|None) -> str|None:
+    return None if value is None else Util.date_as_str(value)
+
+  @staticmethod
+  def _rows(table:Table|List[Table], rows:List[Any]|None=None):
+    """ Get all rows of one or several tables, or only the given rows of one table """
+    if isinstance(table, list):
+      return [todo for x in table for todo in x.map_rows(Todo)]
     if table is not None:
-      return table.map_rows(Todo, Todo._field_name_mappings())
+      return table.map_rows(Todo, rows)
     return None
+
+  @staticmethod
+  def _tables(table:Table|List[Table]|None) -> List[Table]:
+    if isinstance(table, list):
+      return table
+    return [] if table is None else [table]
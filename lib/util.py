@@ -1,5 +1,16 @@
-from typing import List
+from typing import List, Any, Iterable, Iterator
+from itertools import chain, islice
 from datetime import datetime, date
+import re
+from .stats import Stats
+
+SELECTOR_FILTER = re.compile(r'''(\w+):("[^"]*"|'[^']*'|\S*)''')
+# the prefix may hold digits too, as in the shard ids 2024-3..2024-9
+SELECTOR_RANGE = re.compile(r'^(.*?)(\d+)\.\.(.*?)(\d+)$')
+# ids a single range may expand to
+MAX_RANGE_SIZE = 10000
+# rows print_rows sizes the columns by
+SAMPLE_ROWS = 200
 
 class Util:
     """ Utility object """
@@ -12,15 +23,31 @@ class Util:
     def date_as_str(date_obj:date) -> str:
         return date_obj.strftime('%Y-%m-%d')
 
+    @staticmethod
+    def chunks(items:List[Any], size:int) -> Iterator[List[Any]]:
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+
     @staticmethod
     def print_table(table:List[List[str]]) -> None:
-        longest_cols = [
-            (max([len(str(row[i])) for row in table]) + 3)
-            for i in range(len(table[0]))
-        ]
-        row_format = "".join(["{:>" + str(longest_col) + "}" for longest_col in longest_cols])
-        for row in table:
-            print(row_format.format(*row))
+        Util.print_rows(table, len(table))
+
+    @staticmethod
+    def print_rows(rows:Iterable[List[str]], sample:int=SAMPLE_ROWS) -> None:
+        """ print_table of rows made while printing, the columns are as wide as in the first sample rows,
+        a longer value further down pushes the rest of its line to the right """
+        with Stats.phase("render"):
+            rows = iter(rows)
+            head = list(islice(rows, sample))
+            if len(head) == 0:
+                return
+            longest_cols = [
+                (max([len(str(row[i])) for row in head]) + 3)
+                for i in range(len(head[0]))
+            ]
+            row_format = "".join(["{:>" + str(longest_col) + "}" for longest_col in longest_cols])
+            for row in chain(head, rows):
+                print(row_format.format(*row))
 
     @staticmethod
     def parse_args(line:str) -> dict[str, str]:
@@ -44,3 +71,44 @@ class Util:
             args[key.strip()] = quotes[0].strip()
             parts = separator.join(quotes[1:]).strip()
         return args
+
+    @staticmethod
+    def split_commands(script:str) -> List[str]:
+        """ Commands separated by ; or new lines outside of quotes, without blank and # comment lines """
+        commands = []
+        current = ""
+        quote = None
+        for char in script:
+            if quote is not None:
+                if char == quote:
+                    quote = None
+            elif char in "'\"":
+                quote = char
+            elif char in ";\n":
+                commands.append(current)
+                current = ""
+                continue
+            current += char
+        commands.append(current)
+        return [x.strip() for x in commands if x.strip() != "" and not x.strip().startswith("#")]
+
+    @staticmethod
+    def parse_selectors(line:str) -> tuple[List[str], dict[str, str]]:
+        """ Splits `3 5..8 status:"In Progress"` into ids (ranges expanded) and filters, raises ValueError for a bad range """
+        filters = {key: value.strip("\"'") for key, value in SELECTOR_FILTER.findall(line)}
+        ids = []
+        for token in SELECTOR_FILTER.sub(" ", line).split():
+            ids.extend(Util.expand_range(token))
+        return ids, filters
+
+    @staticmethod
+    def expand_range(token:str) -> List[str]:
+        match = SELECTOR_RANGE.match(token)
+        if match is None or match.group(1) != match.group(3):
+            return [token]
+        prefix, start, end = match.group(1), int(match.group(2)), int(match.group(4))
+        if start > end:
+            raise ValueError(f"Range {token} ends before it starts")
+        if end - start >= MAX_RANGE_SIZE:
+            raise ValueError(f"Range {token} holds more than {MAX_RANGE_SIZE} ids")
+        return [f"{prefix}{x}" for x in range(start, end + 1)]
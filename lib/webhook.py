@@ -0,0 +1,164 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+import hashlib
+import hmac
+import json
+if TYPE_CHECKING:
+  from . import Database
+
+CHALLENGE_HEADER = "Smartsheet-Hook-Challenge"
+RESPONSE_HEADER = "Smartsheet-Hook-Response"
+SIGNATURE_HEADER = "Smartsheet-Hmac-SHA256"
+# name of the webhooks registered for the sheets, found again by the next run
+WEBHOOK_NAME = "smartsheet-todo"
+ENABLED = "ENABLED"
+
+class WebhookReceiver:
+  """ HTTP endpoint of the Smartsheet webhooks of the sheets: answers verification challenges
+  and hands the rows named by change events to Database.changed, fetched again by the next read """
+
+  def __init__(self, db:Database, callback_url:str, port:int, host:str="") -> None:
+    """ callback_url is where Smartsheet reaches port of this host, e.g. through a reverse proxy """
+    self.db = db
+    self.callback_url = callback_url
+    self.lock = Lock()
+    # webhook id -> secret its callbacks are signed with
+    self.secrets:dict[int, str] = {}
+    # webhook id -> sheet id, of the webhooks registered by this receiver
+    self.sheets:dict[int, int] = {}
+    # why registering or a webhook failed, see Controller.stats
+    self.errors:List[str] = []
+    receiver = self
+
+    class Callback(BaseHTTPRequestHandler):
+      def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        status, response = receiver.handle(self.headers, body)
+        content = json.dumps(response).encode()
+        self.send_response(status)
+        if "smartsheetHookResponse" in response:
+          self.send_header(RESPONSE_HEADER, response["smartsheetHookResponse"])
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+      def log_message(self, *args) -> None:
+        # the prompt stays readable
+        pass
+
+    self.server = ThreadingHTTPServer((host, port), Callback)
+    self.server.daemon_threads = True
+    self.thread = Thread(target=self.server.serve_forever, name="webhooks", daemon=True)
+
+  def start(self) -> None:
+    self.thread.start()
+
+  def stop(self) -> None:
+    """ The webhooks stay registered, Smartsheet disables them once their callbacks keep failing """
+    self.server.shutdown()
+    self.server.server_close()
+    for sheet_id in list(self.sheets.values()):
+      self.db.watch(sheet_id, False)
+
+  def register(self, table_names:List[str]) -> bool:
+    """ Create, or find again, and enable the webhook of every sheet that exists, returns whether all of them are enabled,
+    a sheet whose webhook is not enabled keeps being checked for a newer version on reads """
+    with self.lock:
+      self.errors = []
+    response = self.db.smart.Webhooks.list_webhooks(include_all=True)
+    if isinstance(response, self.db.smart.models.Error):
+      self._error(f"Unable to list webhooks: {response.result.message}")
+      return False
+    existing = {x.scope_object_id:x for x in response.data if x.name == WEBHOOK_NAME and x.callback_url == self.callback_url}
+    ok = True
+    for name in table_names:
+      sheet_id = self.db.resolver.resolve(name)
+      if sheet_id is not None:
+        ok = self._register(name, sheet_id, existing.get(sheet_id)) and ok
+    return ok
+
+  def handle(self, headers:Any, body:bytes) -> tuple[int, dict[str, Any]]:
+    """ Status and json answer of a callback """
+    try:
+      payload = json.loads(body or b"{}")
+    except ValueError:
+      return 400, {}
+    challenge = headers.get(CHALLENGE_HEADER)
+    if challenge is not None:
+      # sent when the webhook is enabled and every so often after
+      return 200, {"smartsheetHookResponse": challenge}
+    webhook_id = payload.get("webhookId")
+    with self.lock:
+      secret = self.secrets.get(webhook_id)
+      sheet_id = self.sheets.get(webhook_id)
+    signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest() if secret is not None else None
+    if sheet_id is None or signature is None or not hmac.compare_digest(signature, headers.get(SIGNATURE_HEADER) or ""):
+      return 403, {}
+    if "newWebhookStatus" in payload:
+      if payload["newWebhookStatus"] != ENABLED:
+        # the sheet is checked for a newer version again until the next register
+        self._error(f"Webhook of sheet {sheet_id} is {payload['newWebhookStatus']}")
+        self.db.watch(sheet_id, False)
+      return 200, {}
+    rows, deleted, whole = WebhookReceiver.changes(payload.get("events", []))
+    self.db.changed(sheet_id, rows, deleted, whole)
+    return 200, {}
+
+  @staticmethod
+  def changes(events:List[dict[str, Any]]) -> tuple[set[int], set[int], bool]:
+    """ Rows changed and deleted by the events, and whether the sheet must be read again in whole """
+    rows:set[int] = set()
+    deleted:set[int] = set()
+    whole = False
+    for event in events:
+      match event.get("objectType"), event.get("eventType"):
+        case "row", "deleted":
+          deleted.add(event["id"])
+        case "row", _:
+          rows.add(event["id"])
+        case "cell", _:
+          rows.add(event["rowId"])
+        case "column", _:
+          whole = True
+        case "sheet", "deleted":
+          whole = True
+    return rows - deleted, deleted, whole
+
+  def _register(self, name:str, sheet_id:int, webhook:Any) -> bool:
+    smart = self.db.smart
+    if webhook is None:
+      response = smart.Webhooks.create_webhook(smart.models.Webhook({
+        "name": WEBHOOK_NAME,
+        "callbackUrl": self.callback_url,
+        "scope": "sheet",
+        "scopeObjectId": sheet_id,
+        "events": ["*.*"],
+        "version": 1,
+      }))
+      if isinstance(response, smart.models.Error):
+        self._error(f"Unable to create the webhook of {name}: {response.result.message}")
+        return False
+      webhook = response.result
+    with self.lock:
+      self.secrets[webhook.id] = webhook.shared_secret
+      self.sheets[webhook.id] = sheet_id
+    if webhook.enabled and webhook.status == ENABLED:
+      self.db.watch(sheet_id, True)
+      return True
+    # Smartsheet sends the challenge before it answers, the server must be running by now
+    response = smart.Webhooks.update_webhook(webhook.id, smart.models.Webhook({"enabled": True}))
+    if isinstance(response, smart.models.Error):
+      self._error(f"Unable to enable the webhook of {name}: {response.result.message}")
+      return False
+    if response.result.status != ENABLED:
+      self._error(f"Webhook of {name} is {response.result.status}")
+      return False
+    self.db.watch(sheet_id, True)
+    return True
+
+  def _error(self, message:str) -> None:
+    with self.lock:
+      self.errors.append(message)